@@ -2,9 +2,6 @@
 # Date: January 2022
 
 import configparser
-from threading import RLock
-
-csimLock= RLock()
 
 class Cfg:
     def __init__(self):
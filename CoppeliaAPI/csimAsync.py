@@ -0,0 +1,130 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import asyncio
+
+from CoppeliaAPI.lib.b0RemoteApiAsync import AsyncRemoteApiClient
+from CoppeliaAPI.csimBrickpi import BrickPi3
+from CoppeliaAPI.csimCamera import PiCamera
+from CoppeliaAPI.csimDecode import GREY_FORMATS
+
+class AsyncBrickPi3:
+    """
+    asyncio facade of BrickPi3, its methods are coroutines with the same arguments.
+
+    The BrickPi3 ("control" session) and the AsyncPiCamera ("camera" session) have their own
+    client, so an image fetch doesn't delay the sensor reads and motor commands awaited with it:
+
+        BP = AsyncBrickPi3()
+        cam = AsyncPiCamera()
+        encoder, image = await asyncio.gather(BP.get_motor_encoder(BP.PORT_B), cam.capture(output))
+    """
+
+    def __init__(self, brickpi=None, **kwargs):
+        """
+        brickpi -- BrickPi3 to wrap, a new BrickPi3(**kwargs) is created if None
+        """
+        self.brickpi = BrickPi3(**kwargs) if brickpi is None else brickpi
+        self.remote = AsyncRemoteApiClient(self.brickpi.client)
+        self._time = None # simulation time received by the subscriber of sleep
+        self._timeUpdated = None
+
+    def __getattr__(self, name):
+        attr = getattr(self.brickpi, name) # PORT_*, MOTOR_FLOAT... are returned as they are
+        if name.startswith("_") or not callable(attr): return attr
+        async def method(*args, **kwargs):
+            return await self.remote.run(attr, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+    async def now(self):
+        """ Returns the current simulation time in seconds """
+        return await self.remote.run(self.brickpi.clock.now)
+
+    async def sleep(self, dt):
+        """ Sleeps *dt* seconds of simulation time, in synchronous mode the simulation is stepped """
+        if self.brickpi.synchronous:
+            await self.remote.run(self.brickpi.clock.sleep, dt)
+            return
+        end = await self.now() + dt
+        if self._timeUpdated is None:
+            self._timeUpdated = asyncio.Event()
+            topic = await self.remote.simxDefaultSubscriber(self._timeCallback)
+            await self.remote.simxGetSimulationTime(topic)
+        while self._time is None or self._time < end - 1e-6:
+            self._timeUpdated.clear()
+            if self.brickpi.client._dispatcher is None:
+                await self.remote.simxSpinOnce(100) # sleeps until a message arrives, the callback has run after it
+            else:
+                await self._timeUpdated.wait() # the dispatcher of the streaming encoders calls the callback
+
+    def _timeCallback(self, msg):
+        self._time = msg[1]
+        self._timeUpdated.set()
+
+    async def reset_all(self):
+        await self.remote.run(self.brickpi.reset_all)
+        await self.remote.close()
+
+
+class AsyncPiCamera:
+    """ asyncio facade of PiCamera, see AsyncBrickPi3 """
+
+    def __init__(self, camera=None):
+        """
+        camera -- PiCamera to wrap, a new PiCamera is created if None
+        """
+        self.camera = PiCamera() if camera is None else camera
+        if self.camera.client is None: raise ValueError("A camera reading a shared ring has no client")
+        self.remote = AsyncRemoteApiClient(self.camera.client)
+
+    @property
+    def resolution(self):
+        return self.camera.resolution
+
+    @property
+    def sim_time(self):
+        return self.camera.sim_time
+
+    async def set_resolution(self, resolution):
+        """ Sets the resolution of the camera, see PiCamera.resolution """
+        await self.remote.run(setattr, self.camera, "resolution", resolution)
+
+    async def capture(self, output, format="bgr", roi=None, **options):
+        """ Capture an image from the camera, storing it in *output*. See PiCamera.capture """
+        return await self.remote.run(self.camera.capture, output, format, roi, **options)
+
+    async def capture_depth(self, output, roi=None):
+        """ Capture the depth map of the camera in meters, see PiCamera.capture_depth """
+        return await self.remote.run(self.camera.capture_depth, output, roi)
+
+    async def capture_continuous(self, output, format="bgr", roi=None, **options):
+        """
+        Asynchronous generator of images, *output* is yielded after every new frame.
+
+        The vision sensor is streamed through a conflated subscriber like PiCamera.capture_continuous,
+        the event loop runs other coroutines while the next frame is on its way.
+        """
+        cam = self.camera
+        frame = [None]
+        def imageCallback(msg):
+            frame[0] = msg
+
+        topic = await self.remote.simxCreateSubscriber(imageCallback, 1, True)
+        await self.remote.simxGetVisionSensorImageView(cam.cameraHandle, format in GREY_FORMATS, topic)
+        try:
+            while True:
+                # sleeps in the subscriber socket, in the thread of the client, until the frame arrives
+                await self.remote.simxSpinOnce(100)
+                if frame[0] is None: continue
+                ok, resolution, imageBytes = frame[0]
+                frame[0] = None
+                if(not ok): raise SystemError("CoppeliaSim isn't able to return image, check configurations")
+                yield cam._store(output, format, resolution, imageBytes, roi)
+        finally:
+            await self.remote.simxRemoveSubscriber(topic)
+
+    async def close(self):
+        await self.remote.run(self.camera.close)
+        await self.remote.close()
+
@@ -3,10 +3,12 @@
 
 import numpy as np
 import time
+import threading
 
-import CoppeliaAPI.lib.b0RemoteApi as b0RemoteApi
+import CoppeliaAPI.csimSession as csimSession
 import CoppeliaAPI.cfg as cfg
-from CoppeliaAPI.cfg import csimLock
+import CoppeliaAPI.csimScene as csimScene
+from CoppeliaAPI.csimScene import execute, get_handle
 
 cfg = cfg.Cfg()
 
@@ -14,13 +16,23 @@ class _Motor:
     def __init__(self, client,  position = None):
         """ Creates the sensor with the handler """
         if position is not None: 
-            self.handler = client.simxGetObjectHandle(position + 'Motor' + str(cfg.ROBOT_ID), client.simxServiceCall())[1]
+            self.handler = get_handle(client, position + 'Motor')
             client.simxSetJointTargetVelocity(self.handler, 0, client.simxDefaultPublisher())
         else: raise ValueError("Position of the motors is not specified")
         self.last_read = 0
+        self.cached = None # joint position received by the subscriber, see stream
+        self.cached_time = 0
 
     def read(self, client):
-        readed = np.rad2deg(client.simxGetJointPosition(self.handler, client.simxServiceCall())[1])
+        return self.convert(client.simxGetJointPosition(self.handler, client.simxServiceCall())[1])
+
+    def script(self):
+        """ Lua expression that returns the raw value of read, used by BrickPi3.read_all """
+        return "sim.getJointPosition(%d)" % self.handler
+
+    def convert(self, position):
+        """ Converts the joint position (rad) to the encoder value """
+        readed = np.rad2deg(position)
         diff = readed - self.last_read
         self.last_read = readed
         return readed + diff * np.random.normal(0,0.025)
@@ -28,9 +40,21 @@ class _Motor:
     def set_encoder(self, value, client):
         client.simxSetJointPosition(self.handler, value, client.simxDefaultPublisher())
         self.last_read = value
+        self.cached = None
+
+    def stream(self, client, publishInterval):
+        """ Subscribes to the joint position, the client spin updates self.cached """
+        self.cached = None
+        client.simxGetJointPosition(self.handler, client.simxDefaultSubscriber(self._positionCallback, publishInterval))
+
+    def _positionCallback(self, msg):
+        if msg[0]:
+            self.cached = msg[1]
+            self.cached_time = time.time()
 
-    def set_dps(self, dps, client):
-        client.simxSetJointTargetVelocity(self.handler, np.deg2rad(dps), client.simxDefaultPublisher())
+    def setpoint(self, speed):
+        """ Lua expression that applies the target speed (rad/s), used by BrickPi3.set_motor_dps """
+        return "sim.setJointTargetVelocity(%d, %r)" % (self.handler, speed)
 
 ### SENSORES
 class _Button:
@@ -43,23 +67,36 @@ class _Button:
         """ Returns 0 if released, 1 if pressed """
         return 0
 
+    def script(self):
+        return "0"
+
+    def convert(self, value):
+        return 0
+
 class _Ultrasonic:
     """ Simulates the  NXT_ULTRASONIC and EV3_ULTRASONIC_CM BrickPi sensors"""
     def __init__(self, client, position = "front"): # TODO: 2 ultrasonics
         """ Creates the sensor with the handler """
-        self.handler = client.simxGetObjectHandle(position + 'ProximitySensor' + str(cfg.ROBOT_ID), client.simxServiceCall())[1]
+        self.handler = get_handle(client, position + 'ProximitySensor')
 
     def read(self, client):
         """ Uses the ultrasonic sensor to return the distance in cm """
         list = client.simxCheckProximitySensor(self.handler, "sim.handle_all", client.simxServiceCall())
-        if(list[1] == 0 ): return 100000 # en plan return mucho porque no detectamos na
-        else: return list[2]*100 + np.random.normal(0,list[2]) # por cada metro, una varianza de 1 cm
+        return self.convert(list[1:3])
+
+    def script(self):
+        return "{sim.checkProximitySensor(%d, sim.handle_all)}" % self.handler
+
+    def convert(self, list):
+        """ Converts [detected, distance (m)] to the distance in cm """
+        if(list[0] == 0 ): return 100000 # en plan return mucho porque no detectamos na
+        else: return list[1]*100 + np.random.normal(0,list[1]) # por cada metro, una varianza de 1 cm
 
 class _Light:
     """ Simulates the  NXT_LIGHT_ON BrickPi sensor"""
     def __init__(self, client, position = None):
         """ Creates the sensor with the handler """
-        self.handler = client.simxGetObjectHandle('visionLight' + str(cfg.ROBOT_ID),client.simxServiceCall())[1]
+        self.handler = get_handle(client, 'visionLight')
 
     def read(self, client):
         """
@@ -67,15 +104,21 @@ class _Light:
         :return: the amount of light from 4000 (dark, no light) to 0 (bright, full light)
         """
         ok, self.resolution, imageBytes = client.simxGetVisionSensorImage(self.handler, True, client.simxServiceCall())
-        color = int(imageBytes[0])
+        return self.convert(int(imageBytes[0]))
+
+    def script(self):
+        # first pixel of the greyscale image, as in read
+        return "string.byte(sim.getVisionSensorCharImage(%d + sim.handleflag_greyscale, 0, 0, 1, 1))" % self.handler
+
+    def convert(self, color):
         return 4000 * (1 - color / 255)
 
 class _Custom:
     """ Simulates a custom BrickPi sensor, currently GYRO"""
     def __init__(self, client, position = None):
         """ Initializes the Robot R and L values """
-        self.rightHandler = client.simxGetObjectHandle('rightMotor' + str(cfg.ROBOT_ID),client.simxServiceCall())[1]
-        self.leftHandler = client.simxGetObjectHandle('leftMotor' + str(cfg.ROBOT_ID),client.simxServiceCall())[1]
+        self.rightHandler = get_handle(client, 'rightMotor')
+        self.leftHandler = get_handle(client, 'leftMotor')
         self.noise_acum = 0
 
     def read(self, client): # Seguramente lo mejor sea simular un giroscopio bueno y ya
@@ -86,7 +129,14 @@ class _Custom:
         """
         w_d = client.simxGetJointTargetVelocity(self.rightHandler, client.simxServiceCall())[1]
         w_i = client.simxGetJointTargetVelocity(self.leftHandler, client.simxServiceCall())[1]
+        return self.convert([w_d, w_i])
+
+    def script(self):
+        return "{sim.getJointTargetVelocity(%d), sim.getJointTargetVelocity(%d)}" % (self.rightHandler, self.leftHandler)
 
+    def convert(self, velocities):
+        """ Converts [right, left] wheel velocities to the raw gyro value """
+        w_d, w_i = velocities
         w_ang = np.rad2deg((w_d - w_i) * cfg.ROBOT_r / cfg.ROBOT_L) #Speed in degs
 
         self.noise_acum += np.random.normal(0,1)
@@ -95,6 +145,62 @@ class _Custom:
         return [w_raw, 0]
 
 
+class _SimClock:
+    """ Clock in simulation time, updated by a subscriber to the simulation time (BrickPi3.clock) """
+    def __init__(self, brickpi):
+        self.brickpi = brickpi
+        self.time = None
+        self._topic = None
+        self._updated = threading.Condition()
+
+    def now(self):
+        """ Returns the current simulation time in seconds """
+        bp = self.brickpi
+        if self._topic is None:
+            with bp.client.lock:
+                self._topic = bp.client.simxDefaultSubscriber(self._timeCallback)
+                bp.client.simxGetSimulationTime(self._topic)
+                if self.time is None: self.time = bp.client.simxGetSimulationTime(bp.client.simxServiceCall())[1]
+        with bp.client.lock:
+            bp.client.simxSpinOnce()
+        return self.time
+
+    def sleep(self, dt):
+        """ Sleeps *dt* seconds of simulation time """
+        self.sleep_until(self.now() + dt)
+
+    def sleep_until(self, t):
+        """ Sleeps until the simulation time reaches *t* seconds, in synchronous mode the simulation is stepped """
+        bp = self.brickpi
+        while self.now() < t - 1e-6:
+            before = self.time
+            if bp.synchronous: bp.step()
+            # the time of the step may arrive after its step done message
+            self._wait_update(before)
+
+    def _wait_update(self, before, timeout=1):
+        """ Sleeps until a simulation time other than *before* arrives, it's read if none arrives in *timeout* seconds """
+        client = self.brickpi.client
+        end = time.time() + timeout
+        while self.time == before and time.time() < end:
+            if client._dispatcher is None:
+                # sleeps in the socket without the lock, the callback is called by the spin of this thread
+                client.simxWaitForMessage(max(1, int((end - time.time()) * 1000)))
+                with client.lock:
+                    client.simxSpinOnce()
+            else:
+                with self._updated:
+                    if self.time == before: self._updated.wait(max(0, end - time.time()))
+        if self.time == before: # lost message or the simulation isn't running
+            with client.lock:
+                self.time = client.simxGetSimulationTime(client.simxServiceCall())[1]
+
+    def _timeCallback(self, msg):
+        with self._updated:
+            self.time = msg[1]
+            self._updated.notify_all()
+
+
 ### FUNCIONES DE LA API
 class BrickPi3:
 
@@ -129,9 +235,14 @@ class BrickPi3:
         "PORT_4": PORT_4,
     }
     
-    def __init__(self):
+    def __init__(self, streaming=None, synchronous=None):
+        """
+        Keyword arguments:
+        streaming -- stream the motor encoders (see get_motor_encoder), ENCODER_STREAMING of the config file if None
+        synchronous -- the simulation only advances when step is called, SYNCHRONOUS of the config file if None
+        """
         # RESET THE FRICKPI
-        self.client = b0RemoteApi.RemoteApiClient('b0RemoteApiNodeBrickpi','b0RemoteApiChannel')
+        self.client = csimSession.acquire("control")
 
         ## PUERTOS DE SENSORES Y MOTORES
         self.ports_motor={
@@ -146,30 +257,88 @@ class BrickPi3:
             #self.PORT_4 : None, 
         }
 
+        self._snapshot = None # (code, motor ports, sensor ports) of read_all
+        self._motorPublishers = {} # ports -> dedicated publisher of their setpoints, see set_motor_dps
+
         ## Associate motors to ports
         self.ports_motor[self.ports_str[cfg.MOTOR_CLAW]] = _Motor(self.client, "claw")
         self.ports_motor[self.ports_str[cfg.MOTOR_LEFT]] = _Motor(self.client, "left")
         self.ports_motor[self.ports_str[cfg.MOTOR_RIGHT]] = _Motor(self.client, "right")
 
         # Launch simulation
-        self.client.simxSynchronous(False)
+        self.synchronous = cfg.SYNCHRONOUS if synchronous is None else synchronous
+        self._stepDoneTopic = None
+        self._stepDone = threading.Event()
+        self.client.simxSynchronous(self.synchronous)
         self.client.simxStartSimulation(self.client.simxDefaultPublisher())
+        self.clock = _SimClock(self)
+
+        self.streaming = cfg.ENCODER_STREAMING if streaming is None else streaming
+        if self.streaming: self._start_streaming()
         time.sleep(0.5)
 
     def __getstate__(self):
         state = self.__dict__.copy()
         del state["client"]
+        state["_stepDoneTopic"] = None
+        state["_motorPublishers"] = {}
+        del state["_stepDone"]
+        del state["clock"]
+        state["_handles"] = csimScene.handles()
         return state
 
     def __setstate__(self, state):
+        csimScene.seed(state.pop("_handles"))
         self.__dict__.update(state)
-        self.client = b0RemoteApi.RemoteApiClient('b0RemoteApiNodeBrickpi','b0RemoteApiChannel')
+        self._stepDone = threading.Event()
+        self.clock = _SimClock(self)
+        self.client = csimSession.acquire("control")
+        if self.streaming: self._start_streaming()
+
+    def _start_streaming(self):
+        """ Subscribes to the motor encoders and starts the thread that receives them as they arrive """
+        with self.client.lock:
+            for motor in self.ports_motor.values():
+                motor.stream(self.client, cfg.ENCODER_PUBLISH_INTERVAL)
+        self.client.simxStartDispatcher(self.client.lock)
+
+    def step(self, steps=1):
+        """
+        Advance the simulation in synchronous mode
+
+        Keyword arguments:
+        steps -- number of simulation steps to run, returns when the last one is done
+
+        The simulation runs as fast as possible and the results only depend on the
+        control program, as it doesn't move between calls.
+        """
+        if not self.synchronous: raise RuntimeError("BrickPi3 isn't in synchronous mode")
+        if self._stepDoneTopic is None:
+            with self.client.lock:
+                self._stepDoneTopic = self.client.simxDefaultSubscriber(self._stepDoneCallback)
+                self.client.simxGetSimulationStepDone(self._stepDoneTopic)
+        for _ in range(steps):
+            self._stepDone.clear()
+            with self.client.lock:
+                self.client.simxSynchronousTrigger()
+            while not self._stepDone.is_set():
+                with self.client.lock:
+                    self.client.simxSpinOnce(1) # sleeps until a message arrives, unless streaming dispatches them
+                self._stepDone.wait(0.001 if self.streaming else 0)
+
+    def _stepDoneCallback(self, msg):
+        self._stepDone.set()
 
     def reset_all(self):
         # TODO: 
         """Reset the BrickPi. Set all the sensors' type to NONE, set the motors to float, and motors' limits and constants to default, and return control of the LED to the firmware."""
-        with csimLock:
+        if self.streaming: self.client.simxStopDispatcher() # not holding the lock, the dispatcher may be waiting for it
+        with self.client.lock:
+            for topic in self._motorPublishers.values():
+                self.client.simxRemovePublisher(topic)
+            self._motorPublishers = {}
             self.client.simxStopSimulation(self.client.simxServiceCall())
+            csimSession.release(self.client)
             del self.client
 
     def reset_motor_encoder(self, ports):
@@ -179,7 +348,7 @@ class BrickPi3:
         Keyword arguments:
         ports -- The motor port(s). PORT_A, PORT_B, PORT_C, and/or PORT_D.
         """
-        with csimLock:
+        with self.client.lock:
             for port in [ports//i%2*i for i in [1,2,4,8] if ports//i%2 != 0]:
                 self.ports_motor[port].set_encoder(0, self.client)
 
@@ -194,7 +363,7 @@ class BrickPi3:
 
         You can zero the encoder by offsetting it by the current position
         """
-        with csimLock:
+        with self.client.lock:
             for port in [ports//i%2*i for i in [1,2,4,8] if ports//i%2 != 0]:
                 self.ports_motor[port].set_encoder(self.ports_motor[port].read(self.client) -  offset, self.client)
 
@@ -206,9 +375,15 @@ class BrickPi3:
         port -- The motor port (one at a time). PORT_A, PORT_B, PORT_C, or PORT_D.
 
         Gets the encoder position in degrees, which contains the total rotated degrees since a reset 
+
+        When streaming, the last value received is returned without a request unless
+        it is older than ENCODER_MAX_AGE_MS, then it is read synchronously
         """
-        with csimLock:
-            return self.ports_motor[port].read(self.client)
+        motor = self.ports_motor[port]
+        if self.streaming and motor.cached is not None and (time.time() - motor.cached_time) * 1000 <= cfg.ENCODER_MAX_AGE_MS:
+            return motor.convert(motor.cached)
+        with self.client.lock:
+            return motor.read(self.client)
 
 
     def set_motor_dps(self, ports, dps):
@@ -218,10 +393,26 @@ class BrickPi3:
         Keyword arguments:
         ports -- The motor port(s). PORT_A, PORT_B, PORT_C, and/or PORT_D.
         dps -- The target speed in degrees per second
+
+        The setpoints of the ports are sent in a single message, through a dedicated publisher of
+        those ports that drops the stale messages, so CoppeliaSim only applies the newest. Other
+        ports aren't affected. In synchronous mode they go through the default publisher instead,
+        to keep their order with the step triggers.
         """
-        with csimLock:
-            for port in [ports//i%2*i for i in [1,2,4,8]  if ports//i%2 != 0]:
-                self.ports_motor[port].set_dps(dps, self.client)
+        speed = float(np.deg2rad(dps))
+        if not np.isfinite(speed): raise ValueError("The target speed must be a finite number")
+        ports = [ports//i%2*i for i in [1,2,4,8]  if ports//i%2 != 0]
+        if not ports: return
+        code = "{" + ", ".join(self.ports_motor[port].setpoint(speed) for port in ports) + "}"
+        with self.client.lock:
+            if self.synchronous:
+                topic = self.client.simxDefaultPublisher()
+            else:
+                key = sum(ports)
+                if key not in self._motorPublishers:
+                    self._motorPublishers[key] = self.client.simxCreatePublisher(True)
+                topic = self._motorPublishers[key]
+            self.client.simxExecuteScriptString(code, topic)
 
     def set_sensor_type(self, ports, tipo_sensor, params = 0, position=None):
         """
@@ -243,7 +434,8 @@ class BrickPi3:
                     params[4] -- List of bytes to write
                     params[5] -- Number of bytes to read
         """        
-        with csimLock:
+        with self.client.lock:
+            self._snapshot = None
             for port in [ports//i%2*i for i in [1,2,4,8] if ports//i%2 != 0]:
                 if(cfg.ALT_ULTRASOUND_PORT != "None" and self.ports_str[cfg.ALT_ULTRASOUND_PORT] == port):
                     self.ports_sensor[port] = tipo_sensor(self.client, cfg.ALT_ULTRASOUND_DIR)
@@ -291,7 +483,33 @@ class BrickPi3:
                 EV3_INFRARED_REMOTE -------- a list for each of the four channels. For each channel red up, red down, blue up, blue down, boadcast
 
         """
-        with csimLock:
+        with self.client.lock:
             return self.ports_sensor[port].read(self.client)
 
+    def read_all(self):
+        """
+        Read every configured motor encoder and sensor in a single request
+
+        All the values come from the same simulation step, so they are consistent between them.
 
+        Returns a dict with:
+            time ------- simulation time of the readings in seconds
+            motors ----- {port: encoder value in degrees} (same as get_motor_encoder)
+            sensors ---- {port: sensor value} (same as get_sensor)
+        """
+        with self.client.lock:
+            if self._snapshot is None:
+                motors = sorted(self.ports_motor)
+                sensors = sorted(self.ports_sensor)
+                code = "{" + ", ".join(["sim.getSimulationTime()"] +
+                                       [self.ports_motor[port].script() for port in motors] +
+                                       [self.ports_sensor[port].script() for port in sensors]) + "}"
+                self._snapshot = (code, motors, sensors)
+            code, motors, sensors = self._snapshot
+
+            values = execute(self.client, code)
+            return {
+                "time": values[0],
+                "motors": {port: self.ports_motor[port].convert(value) for port, value in zip(motors, values[1:])},
+                "sensors": {port: self.ports_sensor[port].convert(value) for port, value in zip(sensors, values[1 + len(motors):])},
+            }
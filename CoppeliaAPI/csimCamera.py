@@ -3,77 +3,451 @@
 
 import numpy as np
 import time
+import threading
+from collections import deque, namedtuple
 import cv2
-import CoppeliaAPI.lib.b0RemoteApi as b0RemoteApi
+import CoppeliaAPI.csimSession as csimSession
 import CoppeliaAPI.cfg as cfg
-from CoppeliaAPI.cfg import csimLock
+import CoppeliaAPI.csimScene as csimScene
+from CoppeliaAPI.csimDecode import decode_image, decode_depth, GREY_FORMATS
+from CoppeliaAPI.csimFrameRing import FrameRing
 
 cfg = cfg.Cfg()
 
+# Supported capture formats, "yuv" is decoded as "rgb" and converted
+FORMATS = ("rgb", "bgr", "yuv", "gray", "y")
+
+# sim.visionintparam_resolution_x / _y
+VISIONINTPARAM_RESOLUTION_X = 1002
+VISIONINTPARAM_RESOLUTION_Y = 1003
+
+# Frame kept by the background capture thread
+Frame = namedtuple("Frame", ["array", "sim_time", "wall_time"])
+
 class PiCamera():
     """Provides a pure Python interface to the CoppeliaSim camera."""
     def __init__(self):
         """Constructor"""
         self.resolution = (512, 512) #Default resolution
-        self.client = b0RemoteApi.RemoteApiClient('b0RemoteApiNodeCamera','b0RemoteApiChannel')
-        self.client.cameraHandle = self.client.simxGetObjectHandle('visionCamera' + str(cfg.ROBOT_ID),self.client.simxServiceCall())[1]
+        self.framerate = 30 # frames per second of the background capture
+        self.sim_time = 0.0
+        self._simTimeTopic = None
+        self._background = None # background capture, see start_background
+        self._frames = None
+        self._frameReady = threading.Condition() # notified when the background capture adds a frame
+        self._ring = None # shared frames, see start_sharing
+        self._ringFormat = None
+        self._sharing = None
+        self._scratch = None # full resolution frame to resize from
+        self.step_cache = cfg.CAMERA_STEP_CACHE # reuse frames captured in the same simulation step, see capture
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cacheTime = None
+        self._cacheRaw = {} # grey -> (resolution, imageBytes)
+        self._cacheFrames = {} # (format, roi, resolution) -> buffer of the decoded frame, reused between steps
+        self._cacheValid = set() # keys of _cacheFrames decoded in the current step
+        self.client = csimSession.acquire("camera")
+        self.cameraHandle = csimScene.get_handle(self.client, 'visionCamera')
         self.client.simxStartSimulation(self.client.simxDefaultPublisher())
         time.sleep(0.25)
 
 
+    @property
+    def resolution(self):
+        """
+        Resolution (width, height) of the captures, setting it also pushes it to the
+        vision sensor so frames are transferred at that size instead of resized on the client
+        """
+        return self._resolution
+
+    @resolution.setter
+    def resolution(self, resolution):
+        # The frames of the ring and of the background capture are allocated at the current resolution
+        if getattr(self, "_ring", None) is not None or getattr(self, "_background", None) is not None:
+            if tuple(resolution) != self._resolution:
+                raise RuntimeError("The resolution can't be changed while the camera is shared or capturing in background")
+        self._resolution = tuple(resolution)
+        if getattr(self, "client", None) is None: return # not connected yet or reading a shared ring
+        with self.client.lock:
+            self.client.simxSetObjectInt32Param(self.cameraHandle, VISIONINTPARAM_RESOLUTION_X, self._resolution[0], self.client.simxServiceCall())
+            self.client.simxSetObjectInt32Param(self.cameraHandle, VISIONINTPARAM_RESOLUTION_Y, self._resolution[1], self.client.simxServiceCall())
+
     def __getstate__(self):
         state = self.__dict__.copy()
         del state["client"]
+        state["_sharing"] = None
+        state.pop("_stopSharing", None)
+        state.pop("_stopBackground", None)
+        state.pop("_frameReady")
+        state["_scratch"] = None
+        state["_simTimeTopic"] = None
+        state["_background"] = None
+        state["_frames"] = None
+        state["_cacheTime"] = None
+        state["_cacheRaw"] = {}
+        state["_cacheFrames"] = {}
+        state["_cacheValid"] = set()
+        if self._ring is not None:
+            state["_ring"] = (self._ring.name, self._ring.shape, self._ring.slots)
+        state["_handles"] = csimScene.handles()
         return state
 
     def __setstate__(self, state):
+        csimScene.seed(state.pop("_handles"))
         self.__dict__.update(state)
+        self._frameReady = threading.Condition()
+        if self._ring is not None:
+            # The camera is shared by another process, frames are read from its ring
+            name, shape, slots = self._ring
+            self._ring = FrameRing(name, shape, slots)
+            self.client = None
+            return
         # Add baz back since it doesn't exist in the pickle
-        self.client = b0RemoteApi.RemoteApiClient('b0RemoteApiNodeBrickpi','b0RemoteApiChannel')
-        self.client.cameraHandle = self.client.simxGetObjectHandle('visionCamera' + str(cfg.ROBOT_ID),self.client.simxServiceCall())[1]
+        self.client = csimSession.acquire("camera")
 
     def close(self):
         """Finalizes the state of the camera."""
+        if self._background is not None: self.stop_background()
+        if self._ring is not None:
+            if self._ring.owner: self.stop_sharing()
+            else: self._ring.close()
+            self._ring = None
+        csimSession.release(self.client)
         del self.client
 
+    def start_sharing(self, slots=4, format="bgr"):
+        """
+        Starts streaming frames into a shared memory ring that other processes can read.
+
+        Pickled copies of the camera (e.g. passed to a spawned Process) map the ring instead of
+        opening a new connection, their capture and capture_continuous return the newest frame
+        of the ring without copying it.
+
+        :param slots: number of frames kept in the ring
+        :param format: color format of the shared frames, see FORMATS
+        :return: name of the shared memory ring
+        """
+        if self._ring is not None: raise RuntimeError("The camera is already shared")
+        self._ring = FrameRing(shape=self._shape(format), slots=slots, create=True)
+        self._ringFormat = format
+        self._track_sim_time()
+        self._stopSharing = threading.Event()
+        self._sharing = threading.Thread(target=self._share, args=(format,), daemon=True)
+        self._sharing.start()
+        return self._ring.name
+
+    def stop_sharing(self):
+        """ Stops the producer started by start_sharing and frees the ring once it has exited """
+        self._stopSharing.set()
+        self._sharing.join()
+        self._sharing = None
+        self._ring.close()
+        self._ring = None
+        if self._background is None: self._untrack_sim_time()
+
+    def _share(self, format):
+        """ Producer thread, writes every streamed frame in the ring """
+        output = PiRGBArray(self, size=self.resolution)
+        stream = self._stream(output, format, stop=self._stopSharing)
+        try:
+            for frame in stream:
+                self._ring.write(frame.array, self.sim_time)
+        finally:
+            stream.close() # removes the subscriber
+
+    def start_background(self, frames=4, format="bgr"):
+        """
+        Starts capturing frames in a background thread at self.framerate.
+
+        While it runs, capture returns right away with a copy of the newest frame.
 
-    def capture(self, output, format="bgr", **options):
+        :param frames: number of recent frames kept, see recent_frames
+        :param format: color format of the frames, see FORMATS
+        """
+        if self._background is not None: raise RuntimeError("Background capture already running")
+        if frames < 2: raise ValueError("At least 2 frames are needed")
+        self._track_sim_time()
+        self._backgroundFormat = format
+        self._frames = deque(maxlen=frames)
+        self._stopBackground = threading.Event()
+        self._background = threading.Thread(target=self._capture_background, args=(frames, format), daemon=True)
+        self._background.start()
+
+    def stop_background(self):
+        """ Stops the thread started by start_background, waiting for it to exit """
+        self._stopBackground.set()
+        self._background.join()
+        self._background = None
+        self._frames = None
+        if self._sharing is None: self._untrack_sim_time()
+
+    def recent_frames(self):
+        """
+        Returns the frames kept by the background capture, oldest first
+
+        Each Frame has the image array, the simulation time and the wall time (time.time()) of the capture.
+        Arrays are reused, a frame is overwritten once it drops out of the list.
+        """
+        frames = self._frames
+        if frames is None: raise RuntimeError("Background capture isn't running")
+        return list(frames)
+
+    def _capture_background(self, frames, format):
+        """ Background thread, captures at self.framerate into a pool of buffers """
+        pool = [PiRGBArray(self, size=self.resolution) for _ in range(frames)]
+        recent = self._frames
+        stop = self._stopBackground
+        i = 0
+        try:
+            while not stop.is_set():
+                tIni = time.time()
+                resolution, imageBytes = self._fetch(format in GREY_FORMATS)
+                output = self._store(pool[i], format, resolution, imageBytes)
+                with self.client.lock:
+                    self.client.simxSpinOnce() # updates self.sim_time
+                with self._frameReady:
+                    recent.append(Frame(output.array, self.sim_time, tIni))
+                    self._frameReady.notify_all()
+                i = (i + 1) % frames
+                stop.wait(max(0, 1 / self.framerate - (time.time() - tIni)))
+        finally:
+            # wakes the readers waiting for a frame if the capture stops or fails
+            with self._frameReady:
+                stop.set()
+                self._frameReady.notify_all()
+
+    def _track_sim_time(self):
+        """ Subscribes to the simulation time, self.sim_time is updated while the client spins """
+        if self._simTimeTopic is None:
+            with self.client.lock:
+                self._simTimeTopic = self.client.simxDefaultSubscriber(self._simTimeCallback)
+                self.client.simxGetSimulationTime(self._simTimeTopic)
+
+    def _untrack_sim_time(self):
+        """ Removes the subscriber of _track_sim_time, it is created again when needed """
+        if self._simTimeTopic is not None:
+            with self.client.lock:
+                self.client.simxRemoveSubscriber(self._simTimeTopic)
+            self._simTimeTopic = None
+
+    def _simTimeCallback(self, msg):
+        self.sim_time = msg[1]
+
+    def capture(self, output, format="bgr", roi=None, **options):
         """
         Capture an image from the camera, storing it in *output*.
 
-        :param output: rerefence parameter to return the BGR image
-        :param format: color formar of the image, "rbg" and "bgr" supported
-        optional parameters are for not causing errors, this only returns a BGR image
+        :param output: rerefence parameter to return the image
+        :param format: color format of the image, "rgb", "bgr", "yuv", "gray" and "y" supported
+        "gray" and "y" are captured in greyscale by CoppeliaSim and stored as (height, width) arrays
+        :param roi: optional (x, y, w, h) window of the image, in self.resolution pixels.
+        Only that window is flipped, converted and resized, and the array has its size
+        optional parameters are for not causing errors
+
+        With step_cache (CAMERA_STEP_CACHE in the config file), captures in the same simulation step
+        reuse the decoded frame (see cache_hits and cache_misses). The step is known from a subscriber
+        to the simulation time, so right after a new step the frame of the previous one may be returned
+        until its time message is received. Each miss also costs a copy of the frame into the cache.
         """
-        reverse = cfg.CAM_REVERSE
+        if self._ring is not None:
+            self._read_shared(output, format, -1, roi)
+            return
+        if self._background is not None:
+            self._read_background(output, format, roi)
+            return
+        if not self.step_cache:
+            resolution, imageBytes = self._fetch(format in GREY_FORMATS)
+            self._store(output, format, resolution, imageBytes, roi)
+            return
+
+        # Frames can't change during a simulation step, reuse the ones already decoded
+        with self.client.lock:
+            self._track_sim_time()
+            self.client.simxSpinOnce()
+            if self.sim_time != self._cacheTime:
+                self._cacheTime = self.sim_time
+                self._cacheRaw = {}
+                # only the buffers used in the last step are kept for the next ones
+                self._cacheFrames = {key: self._cacheFrames[key] for key in self._cacheValid}
+                self._cacheValid.clear()
+            key = (format, None if roi is None else tuple(roi), tuple(self.resolution))
+            if key in self._cacheValid:
+                frame = self._cacheFrames[key]
+                self.cache_hits += 1
+                if type(output) != PiRGBArray:
+                    output = PiRGBArray(self, size = self.resolution)
+                dst = output._buffer(frame.shape)
+                np.copyto(dst, frame)
+                output.array = dst
+                return
+
+            self.cache_misses += 1
+            grey = format in GREY_FORMATS
+            if grey not in self._cacheRaw:
+                self._cacheRaw[grey] = self._fetch(grey)
+            resolution, imageBytes = self._cacheRaw[grey]
+            output = self._store(output, format, resolution, imageBytes, roi)
+            frame = self._cacheFrames.get(key)
+            if frame is None or frame.shape != output.array.shape:
+                frame = self._cacheFrames[key] = np.empty_like(output.array)
+            np.copyto(frame, output.array)
+            self._cacheValid.add(key)
 
-        with csimLock:
-            ok, self.true_resolution, imageBytes = self.client.simxGetVisionSensorImage(self.client.cameraHandle, False, self.client.simxServiceCall())
+    def _fetch(self, grey=False):
+        """ Requests the current image of the vision sensor, returns (resolution, imageBytes) without copying the reply """
+        with self.client.lock:
+            ok, resolution, imageBytes = self.client.simxGetVisionSensorImageView(self.cameraHandle, grey, self.client.simxServiceCall())
         if(not ok): raise SystemError("CoppeliaSim isn't able to return image, check configurations")
-        self.true_resolution = tuple(self.true_resolution)
+        return resolution, imageBytes
 
-        # Construct the RGB numpy image
-        img = np.zeros([self.true_resolution[1], self.true_resolution[0], 3], dtype = "uint8")
-        for i in range(self.true_resolution[1]):
-            for j in range(self.true_resolution[0]):
-                pixel = list(imageBytes[3*(j+i*self.true_resolution[0]) : 3*(j+i*self.true_resolution[0]) + 3])
-                img[self.true_resolution[1] - 1 - i][j] = pixel
+    def _read_background(self, output, format, roi=None):
+        """ Copies the newest frame of the background capture into *output* """
+        if format != self._backgroundFormat: raise ValueError("Background frames are captured in " + self._backgroundFormat + " format")
+        stop = self._stopBackground
+        with self._frameReady:
+            self._frameReady.wait_for(lambda: self._frames is None or self._frames or stop.is_set())
+            frames = self._frames
+            if not frames: raise RuntimeError("Background capture has stopped")
+            frame = frames[-1]
+        self.sim_time = frame.sim_time
 
-        # Check format
-        if format == "bgr": img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-        elif format == "rgb": pass
-        else: raise ValueError("Only rgb and bgr formats supported")
+        if type(output) != PiRGBArray:
+            output = PiRGBArray(self, size = self.resolution)
+        img = self._crop(frame.array, roi)
+        dst = output._buffer(img.shape)
+        np.copyto(dst, img)
+        output.array = dst
+
+    def capture_depth(self, output, roi=None):
+        """
+        Capture the depth map of the camera in meters, storing it in *output*.
+
+        :param output: rerefence parameter (PiDepthArray) to return the float32 depth map
+        :param roi: optional (x, y, w, h) window of the depth map to return
+        :return: the depth map, a read-only view over the received bytes
+        """
+        if self.client is None: raise RuntimeError("Depth isn't available from a shared camera")
+        with self.client.lock:
+            ok, resolution, depthBytes = self.client.simxGetVisionSensorDepthBuffer(self.cameraHandle, True, True, self.client.simxServiceCall())
+        if(not ok): raise SystemError("CoppeliaSim isn't able to return depth, check configurations")
+
+        if type(output) != PiDepthArray:
+            output = PiDepthArray(self)
+        output.array = decode_depth(depthBytes, resolution, cfg.CAM_REVERSE, roi)
+        return output.array
+
+    def capture_continuous(self, output, format="bgr", roi=None, **options):
+        """
+        Capture images continuously from the camera, storing each one in *output*.
+
+        The vision sensor is streamed through a subscriber that only keeps the newest frame,
+        so there is no round-trip per frame and stale frames are dropped.
+
+        :param output: rerefence parameter to return the image, yielded after every frame
+        :param format: color format of the image, see capture
+        :param roi: optional (x, y, w, h) window of the image, see capture
+        optional parameters are for not causing errors
+        """
+        if self._ring is not None:
+            return self._stream_shared(output, format, roi)
+        return self._stream(output, format, roi)
+
+    def _stream(self, output, format, roi=None, stop=None):
+        """ Generator of frames received through a conflated subscriber, it ends when the *stop* Event is set """
+        frame = [None]
+        def imageCallback(msg):
+            frame[0] = msg
+
+        with self.client.lock:
+            topic = self.client.simxCreateSubscriber(imageCallback, 1, True)
+            self.client.simxGetVisionSensorImageView(self.cameraHandle, format in GREY_FORMATS, topic)
+        try:
+            while stop is None or not stop.is_set():
+                with self.client.lock:
+                    self.client.simxSpinOnce(1) # sleeps until a message arrives
+                if frame[0] is None:
+                    continue
+                ok, resolution, imageBytes = frame[0]
+                frame[0] = None
+                if(not ok): raise SystemError("CoppeliaSim isn't able to return image, check configurations")
+                yield self._store(output, format, resolution, imageBytes, roi)
+        finally:
+            with self.client.lock:
+                self.client.simxRemoveSubscriber(topic)
+
+    def _stream_shared(self, output, format, roi=None):
+        """ Generator of the frames of the shared ring, waits for each new frame """
+        seq = -1
+        while True:
+            output, seq = self._read_shared(output, format, seq, roi)
+            yield output
+
+    def _read_shared(self, output, format, last, roi=None):
+        """ Points *output* to the newest frame of the ring newer than *last*, returns (output, seq) """
+        if format != self._ringFormat: raise ValueError("Shared frames are stored in " + self._ringFormat + " format")
+        seq, self.sim_time, _, img = self._ring.wait(last)
 
-        if reverse: img = cv2.flip(cv2.flip(img, 0), 1)
+        if type(output) != PiRGBArray:
+            output = PiRGBArray(self, size = self.resolution)
+        output.array = self._crop(img, roi)
+        return output, seq
+
+    def _store(self, output, format, resolution, imageBytes, roi=None):
+        """ Decodes the image bytes (only the *roi* window if given) into *output*, returns the PiRGBArray used """
+        if format not in FORMATS: raise ValueError("Only rgb, bgr, yuv, gray and y formats supported")
+        reverse = cfg.CAM_REVERSE
+        self.true_resolution = tuple(resolution)
 
         # Create PiRGBArray class for transparence
         if type(output) != PiRGBArray:
-            output = PiRGBArray(self, size = self.true_resolution)
-        elif(hasattr(output, 'size') and output.size != self.resolution):
+            output = PiRGBArray(self, size = self.resolution)
+        elif(output.size is None or tuple(output.size) != tuple(self.resolution)):
              raise ValueError("Camera resolution and PiRGBArray resolution aren't equal")
-        output.array = cv2.resize(img, self.resolution, interpolation = cv2.INTER_AREA)
 
-        
+        # Window of the sensor image to decode and size of the result
+        if roi is None:
+            size = tuple(self.resolution)
+            window = None
+        else:
+            self._check_roi(roi)
+            x, y, w, h = roi
+            sx = self.true_resolution[0] / self.resolution[0]
+            sy = self.true_resolution[1] / self.resolution[1]
+            size = (w, h)
+            window = (int(x * sx), int(y * sy), max(1, int(w * sx)), max(1, int(h * sy)))
+
+        # Decode the bytes as a view, flips and color swap are done while copying into the buffers
+        img = decode_image(imageBytes, self.true_resolution, "rgb" if format == "yuv" else format, reverse, window)
+        dst = output._buffer(self._shape(format, size))
+        if img.shape[:2] == dst.shape[:2]:
+            np.copyto(dst, img)
+        else:
+            if self._scratch is None or self._scratch.shape != img.shape:
+                self._scratch = np.empty(img.shape, dtype=np.uint8)
+            np.copyto(self._scratch, img)
+            cv2.resize(self._scratch, size, dst=dst, interpolation = cv2.INTER_AREA)
+        if format == "yuv": cv2.cvtColor(dst, cv2.COLOR_RGB2YUV, dst=dst)
+        output.array = dst
+        return output
+
+    def _shape(self, format, size=None):
+        """ Shape of the captured arrays for *format*, at *size* or the camera resolution """
+        if size is None: size = self.resolution
+        if format in GREY_FORMATS: return (size[1], size[0])
+        return (size[1], size[0], 3)
+
+    def _check_roi(self, roi):
+        x, y, w, h = roi
+        if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > self.resolution[0] or y + h > self.resolution[1]:
+            raise ValueError("The roi must be inside the camera resolution")
+
+    def _crop(self, img, roi):
+        """ View of the *roi* window of an already captured image """
+        if roi is None: return img
+        self._check_roi(roi)
+        x, y, w, h = roi
+        return img[y:y + h, x:x + w]
+
 
 class PiRGBArray():
     """Class that contains the image in the self.array field stored as a numpy array (same interface as PiCamera Class)"""
@@ -82,3 +456,23 @@ class PiRGBArray():
         self.camera = camera
         self.size = size
         self.array = None
+        self._array = None # persistent buffer, captures are written in place
+        if size is not None: self._buffer((size[1], size[0], 3))
+
+    def _buffer(self, shape):
+        """ Returns the persistent image buffer, only allocated when its shape changes """
+        if self._array is None or self._array.shape != shape:
+            self._array = np.empty(shape, dtype=np.uint8)
+        return self._array
+
+    def truncate(self, size=None):
+        """ Kept for picamera compatibility (rawCapture.truncate(0)), every capture overwrites the array """
+        pass
+
+
+class PiDepthArray():
+    """Class that contains the depth map in meters in the self.array field stored as a float32 numpy array"""
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.array = None
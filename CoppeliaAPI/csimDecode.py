@@ -0,0 +1,57 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import numpy as np
+
+FORMATS = ("rgb", "bgr", "gray", "y")
+GREY_FORMATS = ("gray", "y") # single channel, requested in greyscale to CoppeliaSim
+
+def decode_image(imageBytes, resolution, format="bgr", reverse=False, roi=None):
+    """
+    Decodes the raw image returned by simxGetVisionSensorImage without copying it
+
+    :param imageBytes: bytes-like object with the RGB (or grey) pixels, bottom row first
+    :param resolution: (width, height) of the image, as returned by CoppeliaSim
+    :param format: color format of the image, "rgb", "bgr", "gray" and "y" supported
+    :param reverse: rotates the image 180 degrees (CAM_REVERSE)
+    :param roi: optional (x, y, w, h) window of the resulting image
+    :return: read-only numpy view (height, width, 3), or (height, width) for grey formats, over imageBytes
+    """
+    if format not in FORMATS: raise ValueError("Only rgb, bgr, gray and y formats supported")
+
+    if format in GREY_FORMATS:
+        img = np.frombuffer(imageBytes, dtype=np.uint8).reshape(resolution[1], resolution[0])
+    else:
+        img = np.frombuffer(imageBytes, dtype=np.uint8).reshape(resolution[1], resolution[0], 3)
+
+    # CoppeliaSim sends the bottom row first, so the vertical flip is always needed.
+    # Rotating 180 degrees on top of it leaves only the horizontal flip
+    if reverse: img = img[:, ::-1]
+    else: img = img[::-1]
+
+    if roi is not None:
+        x, y, w, h = roi
+        img = img[y:y + h, x:x + w]
+
+    if format == "bgr": img = img[..., ::-1]
+    return img
+
+def decode_depth(depthBytes, resolution, reverse=False, roi=None):
+    """
+    Decodes the depth buffer returned by simxGetVisionSensorDepthBuffer as a byte array without copying it
+
+    :param depthBytes: bytes-like object with the float32 depths, bottom row first
+    :param resolution: (width, height) of the buffer, as returned by CoppeliaSim
+    :param reverse: rotates the map 180 degrees (CAM_REVERSE)
+    :param roi: optional (x, y, w, h) window of the resulting map
+    :return: read-only numpy view (height, width) over depthBytes
+    """
+    depth = np.frombuffer(depthBytes, dtype="<f4").reshape(resolution[1], resolution[0])
+
+    if reverse: depth = depth[:, ::-1]
+    else: depth = depth[::-1]
+
+    if roi is not None:
+        x, y, w, h = roi
+        depth = depth[y:y + h, x:x + w]
+    return depth
@@ -0,0 +1,130 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import atexit
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_META = np.dtype([("seq", "<i8"), ("sim_time", "<f8"), ("wall_time", "<f8")])
+
+# Rings closed while their frames were still referenced, unmapped once they are released
+_closing = []
+
+def _unmap_released():
+    for shm in list(_closing):
+        try:
+            shm.close()
+            _closing.remove(shm)
+        except BufferError: pass
+
+atexit.register(_unmap_released)
+
+class FrameRing:
+    """
+    Fixed-size ring of decoded frames stored in shared memory.
+
+    One process (the camera producer) writes frames, any number of processes can map the ring
+    by name and read the latest frame without copying it. Every slot is tagged with a sequence
+    number and the simulation and wall times of the frame.
+
+    Memory layout: [latest seq][slots x (seq, sim_time, wall_time)][slots x frame]
+    """
+
+    def __init__(self, name=None, shape=(512, 512, 3), slots=4, create=False):
+        """
+        Creates (producer) or maps (consumer) the ring
+
+        :param name: name of the shared memory block, generated when creating if None
+        :param shape: shape of every frame, (height, width, channels)
+        :param slots: number of frames kept in the ring
+        :param create: True for the producer, False to map an existing ring
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = create
+        frameSize = int(np.prod(self.shape))
+        metaSize = 8 + slots * _META.itemsize
+
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=metaSize + slots * frameSize)
+        else:
+            # Only the producer must unlink the block. Before python 3.13 mapping also registers it
+            # in the resource tracker, which spawned children share with the producer
+            try: self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError: self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+        # frombuffer keeps the buffer exported while any view of the arrays exists,
+        # so the mapping can't be closed under a frame still in use (see close)
+        self._latest = np.frombuffer(self.shm.buf, dtype="<i8", count=1, offset=0)
+        self._meta = np.frombuffer(self.shm.buf, dtype=_META, count=slots, offset=8)
+        self._frames = np.frombuffer(self.shm.buf, dtype=np.uint8, count=slots * frameSize, offset=metaSize).reshape((slots,) + self.shape)
+        if create:
+            self._latest[0] = -1
+            self._meta["seq"] = -1
+
+    def write(self, img, sim_time):
+        """ Stores *img* in the next slot, returns its sequence number """
+        seq = int(self._latest[0]) + 1
+        slot = seq % self.slots
+        self._meta["seq"][slot] = -1 # slot being written
+        self._frames[slot] = img
+        self._meta["sim_time"][slot] = sim_time
+        self._meta["wall_time"][slot] = time.time()
+        self._meta["seq"][slot] = seq
+        self._latest[0] = seq
+        return seq
+
+    def latest(self):
+        """
+        Returns the newest frame as (seq, sim_time, wall_time, array) or None if there isn't any yet
+
+        The array is a view over the shared memory, it stays valid while valid(seq) is True,
+        i.e. until the producer has written *slots* more frames.
+        """
+        seq = int(self._latest[0])
+        if seq < 0: return None
+        slot = seq % self.slots
+        meta = self._meta[slot]
+        if meta["seq"] != seq: return None
+        return seq, float(meta["sim_time"]), float(meta["wall_time"]), self._frames[slot]
+
+    def wait(self, last):
+        """
+        Returns latest() once it is newer than the frame *last*
+
+        A producer in another process can't wake the reader, so it sleeps until the next frame is
+        due (the interval between the last two frames after the newest one) and then in tenths of it.
+        """
+        while True:
+            frame = self.latest()
+            if frame is not None and frame[0] != last: return frame
+            time.sleep(self._next_delay())
+
+    def _next_delay(self):
+        """ Seconds to sleep before looking for a new frame, 1 ms until there are two frames """
+        seq = int(self._latest[0])
+        newest, previous = self._meta[seq % self.slots], self._meta[(seq - 1) % self.slots]
+        if seq < 1 or newest["seq"] != seq or previous["seq"] != seq - 1: return 0.001
+        interval = min(max(float(newest["wall_time"] - previous["wall_time"]), 0.001), 0.1)
+        due = float(newest["wall_time"]) + interval - time.time()
+        return due if due > 0 else interval / 10
+
+    def valid(self, seq):
+        """ True if the frame *seq* has not been overwritten """
+        return self._meta["seq"][seq % self.slots] == seq
+
+    def close(self):
+        """
+        Unmaps the ring, the producer also frees the shared memory
+
+        Frames returned by latest that are still referenced keep the mapping alive,
+        it is unmapped after they are released.
+        """
+        del self._latest, self._meta, self._frames
+        if self.owner: self.shm.unlink()
+        try: self.shm.close()
+        except BufferError: _closing.append(self.shm)
+        _unmap_released()
@@ -0,0 +1,334 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import os
+import threading
+import time
+from collections import deque
+from multiprocessing import Event, Process
+from multiprocessing.connection import Client, Listener
+
+import CoppeliaAPI.lib.b0RemoteApi as b0RemoteApi
+
+# Spawned processes inherit the environment, so they connect to the same proxy
+ADDRESS_VARIABLE = "CSIM_PROXY_ADDRESS"
+
+# Publish commands that set a value, a newer one makes the queued ones useless.
+# Function -> number of leading arguments that identify what is set (joint, object and reference frame)
+SETPOINTS = {
+    "SetJointTargetVelocity": 1,
+    "SetJointTargetPosition": 1,
+    "SetJointPosition": 1,
+    "SetJointForce": 1,
+    "SetObjectPosition": 2,
+    "SetObjectOrientation": 2,
+    "SetObjectQuaternion": 2,
+    "SetObjectPose": 2,
+}
+
+def start_proxy():
+    """
+    Starts the proxy process and makes csimSession use it in this process and its children
+
+    :return: address of the proxy
+    """
+    listener = Listener()
+    address = listener.address
+    listener.close()
+    ready = Event()
+    process = Process(target=serve, args=(address, ready), daemon=True)
+    process.start()
+    # the processes connect as soon as the variable is set, the proxy must be listening
+    while not ready.wait(0.1):
+        if not process.is_alive(): raise SystemError("The proxy process couldn't be started")
+    os.environ[ADDRESS_VARIABLE] = address
+    return address
+
+def serve(address, ready=None):
+    """ Runs the proxy: one B0 session with CoppeliaSim per session name, shared by every connected process """
+    proxy = RemoteApiProxy(address)
+    if ready is not None: ready.set()
+    proxy.run()
+
+
+class RemoteApiProxy:
+    """
+    Multiplexes many local processes over one RemoteApiClient per session name (see csimSession.acquire).
+
+    A process connects once per session name, so the image transfers of the "camera" session don't delay
+    the requests of the "control" session, as without the proxy. A thread per connection receives the
+    requests of its process and queues them in its session, and the worker of the session executes them
+    on its B0 session in order. Requests are pipelined (a process can send several before the replies
+    arrive) and queued publish commands that set the same value (SETPOINTS, or anything sent to a
+    dedicated publisher that drops messages) are coalesced, only the newest one is sent.
+
+    The first message of a process is the session name, replied with ("ready",) once connected to CoppeliaSim.
+    Then, messages from the processes: (kind, reqId, topic, funcName, reqArgs, options)
+        call ------- service call, replied with ("reply", reqId, rep)
+        publish ---- sent through the default publisher or a dedicated one (topic)
+        subscribe -- funcName is streamed to topic, messages are sent as ("message", topic, msg)
+        create ----- creates a dedicated publisher, replied with ("reply", reqId, topic)
+        remove ----- removes a subscriber or a dedicated publisher
+    Calls and creates that fail are replied with ("error", reqId, description).
+    """
+
+    def __init__(self, address):
+        self.listener = Listener(address)
+        self._sessions = {} # name -> _ProxySession
+        self._lock = threading.Lock()
+
+    def run(self):
+        while True:
+            conn = self.listener.accept()
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _session(self, name):
+        with self._lock:
+            if name not in self._sessions:
+                self._sessions[name] = _ProxySession(name)
+            return self._sessions[name]
+
+    def _receive(self, conn):
+        """ Queues the requests of one process in its session """
+        try:
+            session = self._session(conn.recv())
+            conn.send(("ready",))
+        except Exception:
+            conn.close()
+            raise
+        try:
+            while True:
+                session.put(conn, conn.recv())
+        except (EOFError, OSError):
+            session.put(conn, ("close", None, None, None, None, None))
+
+
+class _ProxySession:
+    """ B0 session of the proxy for a session name, with its queue of requests and the worker that executes them """
+
+    def __init__(self, name):
+        self.client = b0RemoteApi.RemoteApiClient('b0RemoteApiNodeProxy' + name.capitalize(), 'b0RemoteApiChannel')
+        self.lock = threading.RLock() # taken by the worker and by the dispatcher of the subscriber messages
+        self._requests = deque()
+        self._pending = threading.Condition()
+        self._subscribers = {} # (connection, topic) -> proxy topic
+        self._conflated = set() # dedicated publishers that drop messages
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def put(self, conn, request):
+        with self._pending:
+            self._requests.append((conn, request))
+            self._pending.notify()
+
+    def _take(self):
+        """ Waits for requests and takes them, dropping publish commands replaced by a newer one """
+        with self._pending:
+            while not self._requests: self._pending.wait()
+            requests = list(self._requests)
+            self._requests.clear()
+        keys = [self._setpoint(request) for conn, request in requests]
+        last = {key: i for i, key in enumerate(keys) if key is not None}
+        return [item for i, (item, key) in enumerate(zip(requests, keys)) if key is None or last[key] == i]
+
+    def _setpoint(self, request):
+        """ Returns what a publish request sets, requests with the same key replace the older ones (None if never replaced) """
+        kind, reqId, topic, funcName, reqArgs, options = request
+        if kind != "publish": return None
+        if topic in self._conflated: return (topic,)
+        arguments = SETPOINTS.get(funcName)
+        if arguments is None: return None
+        return (topic, funcName, repr(reqArgs[:arguments]))
+
+    def _work(self):
+        """ Executes the requests on the B0 session, a failed request doesn't stop the worker """
+        while True:
+            for conn, request in self._take():
+                with self.lock:
+                    try:
+                        self._execute(conn, *request)
+                    except (EOFError, OSError):
+                        pass # the process has left, its close request is queued
+                    except Exception as e:
+                        self._fail(conn, request, e)
+
+    def _execute(self, conn, kind, reqId, topic, funcName, reqArgs, options):
+        client = self.client
+        if kind == "call":
+            conn.send(("reply", reqId, client._handleFunction(funcName, reqArgs, client.simxServiceCall())))
+        elif kind == "publish":
+            client._handleFunction(funcName, reqArgs, topic or client.simxDefaultPublisher())
+        elif kind == "subscribe":
+            key = (conn, topic)
+            if key not in self._subscribers:
+                callback = self._forward(conn, topic)
+                if options["dedicated"]:
+                    self._subscribers[key] = client.simxCreateSubscriber(callback, options["publishInterval"], options["dropMessages"])
+                else:
+                    self._subscribers[key] = client.simxDefaultSubscriber(callback, options["publishInterval"])
+                # the messages are forwarded as they arrive, holding the lock of the session
+                client.simxStartDispatcher(self.lock)
+            client._handleFunction(funcName, reqArgs, self._subscribers[key])
+        elif kind == "create":
+            topic = client.simxCreatePublisher(options["dropMessages"])
+            if options["dropMessages"]: self._conflated.add(topic)
+            conn.send(("reply", reqId, topic))
+        elif kind == "remove":
+            if (conn, topic) in self._subscribers:
+                client.simxRemoveSubscriber(self._subscribers.pop((conn, topic)))
+            else:
+                client.simxRemovePublisher(topic)
+                self._conflated.discard(topic)
+        elif kind == "close":
+            for key in [key for key in self._subscribers if key[0] is conn]:
+                client.simxRemoveSubscriber(self._subscribers.pop(key))
+            conn.close()
+
+    def _fail(self, conn, request, error):
+        """ Replies the error to the process, or prints it if the request has no reply """
+        description = "%s: %s" % (type(error).__name__, error)
+        try:
+            if request[1] is not None: conn.send(("error", request[1], description))
+            else: print('B0 Remote API proxy error: ' + description)
+        except (EOFError, OSError):
+            pass
+
+    def _forward(self, conn, topic):
+        def callback(msg):
+            try: conn.send(("message", topic, msg))
+            except (EOFError, OSError): pass
+        return callback
+
+
+class ProxyRemoteApiClient(b0RemoteApi.RemoteApiClient):
+    """
+    RemoteApiClient that sends every request through a RemoteApiProxy instead of its own B0 node.
+
+    Every simx* function of RemoteApiClient is available, including subscribers and dedicated publishers.
+    """
+
+    def __init__(self, address=None, channelName='b0RemoteApiChannel', timeout=3, name="control"):
+        """
+        timeout -- seconds to wait for the reply of a request, as the timeout of RemoteApiClient
+        name -- session of the proxy used (see csimSession.acquire), each one has its own B0 session
+        """
+        self._conn = Client(address or os.environ[ADDRESS_VARIABLE])
+        self._conn.send(name)
+        self._conn.recv() # ("ready",) once the proxy is connected to CoppeliaSim
+        self._timeout = timeout
+        self._channelName = channelName
+        self._serviceCallTopic = channelName + 'SerX'
+        self._defaultPublisherTopic = channelName + 'SubX'
+        self._nextDefaultSubscriberHandle = 2
+        self._nextDedicatedSubscriberHandle = 1000
+        self._nextRequestId = 0
+        self._replies = {}
+        self._messages = deque()
+        self._allSubscribers = {}
+        self._allDedicatedPublishers = {}
+        self._lock = threading.RLock()
+        self._dispatcher = None
+
+    def __exit__(self, *err):
+        self.simxStopDispatcher()
+        self._conn.close()
+
+    def _handleFunction(self, funcName, reqArgs, topic):
+        with self._lock:
+            if topic == self._serviceCallTopic:
+                reqId = self._nextRequestId
+                self._nextRequestId += 1
+                self._conn.send(("call", reqId, None, funcName, reqArgs, None))
+                rep = self._wait(reqId)
+                if len(rep) == 1:
+                    rep.append(None)
+                return rep
+            elif topic == self._defaultPublisherTopic:
+                self._conn.send(("publish", None, None, funcName, reqArgs, None))
+            elif topic in self._allSubscribers:
+                self._conn.send(("subscribe", None, topic, funcName, reqArgs, self._allSubscribers[topic]['options']))
+            elif topic in self._allDedicatedPublishers:
+                self._conn.send(("publish", None, topic, funcName, reqArgs, None))
+            else:
+                print('B0 Remote API error: invalid topic')
+
+    def _wait(self, reqId):
+        """ Receives until the reply to *reqId* arrives, keeping the subscriber messages """
+        end = time.time() + self._timeout
+        while reqId not in self._replies:
+            remaining = end - time.time()
+            if remaining <= 0 or not self._conn.poll(remaining):
+                raise SystemError("The remote API proxy didn't reply in %s seconds" % self._timeout)
+            self._dispatch(self._conn.recv())
+        rep = self._replies.pop(reqId)
+        if isinstance(rep, Exception): raise rep
+        return rep
+
+    def _dispatch(self, received):
+        if received[0] == "reply":
+            self._replies[received[1]] = received[2]
+        elif received[0] == "error":
+            self._replies[received[1]] = SystemError("The remote API proxy failed: " + received[2])
+        else:
+            self._messages.append(received[1:])
+
+    def simxCreatePublisher(self, dropMessages=False):
+        with self._lock:
+            reqId = self._nextRequestId
+            self._nextRequestId += 1
+            self._conn.send(("create", reqId, None, None, None, {"dropMessages": dropMessages}))
+            topic = self._wait(reqId)
+            self._allDedicatedPublishers[topic] = True
+            return topic
+
+    def simxDefaultSubscriber(self, cb, publishInterval=1):
+        topic = self._channelName + 'Pub' + str(self._nextDefaultSubscriberHandle)
+        self._nextDefaultSubscriberHandle += 1
+        self._allSubscribers[topic] = {'cb': cb, 'dropMessages': False,
+                                       'options': {"dedicated": False, "publishInterval": publishInterval, "dropMessages": False}}
+        return topic
+
+    def simxCreateSubscriber(self, cb, publishInterval=1, dropMessages=False):
+        topic = self._channelName + 'Pub' + str(self._nextDedicatedSubscriberHandle)
+        self._nextDedicatedSubscriberHandle += 1
+        self._allSubscribers[topic] = {'cb': cb, 'dropMessages': dropMessages,
+                                       'options': {"dedicated": True, "publishInterval": publishInterval, "dropMessages": dropMessages}}
+        return topic
+
+    def simxRemoveSubscriber(self, topic):
+        with self._lock:
+            if topic in self._allSubscribers:
+                self._conn.send(("remove", None, topic, None, None, None))
+                del self._allSubscribers[topic]
+
+    def simxRemovePublisher(self, topic):
+        with self._lock:
+            if topic in self._allDedicatedPublishers:
+                self._conn.send(("remove", None, topic, None, None, None))
+                del self._allDedicatedPublishers[topic]
+
+    def simxWaitForMessage(self, timeoutInMs=-1):
+        """ Sleeps until a message arrives or timeoutInMs elapses (-1 without limit), returns True if there is one """
+        if self._messages: return True
+        return self._conn.poll(None if timeoutInMs < 0 else timeoutInMs / 1000)
+
+    def _spinOnce(self):
+        with self._lock:
+            while self._conn.poll(0):
+                self._dispatch(self._conn.recv())
+            messages = list(self._messages)
+            self._messages.clear()
+        # Conflated subscribers only get their newest message
+        latest = {}
+        for i, (topic, msg) in enumerate(messages):
+            latest[topic] = i
+        for i, (topic, msg) in enumerate(messages):
+            subscriber = self._allSubscribers.get(topic)
+            if subscriber is None or (subscriber['dropMessages'] and latest[topic] != i): continue
+            subscriber['cb'](msg)
+
+    def simxGetTimeInMs(self):
+        return time.time() * 1000
+
+    def simxGetVisionSensorImageView(self, objectHandle, greyScale, topic):
+        """ Replies are copied through the proxy connection anyway """
+        return self.simxGetVisionSensorImage(objectHandle, greyScale, topic)
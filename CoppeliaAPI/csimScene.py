@@ -0,0 +1,62 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+from threading import RLock
+
+import CoppeliaAPI.cfg as cfg
+
+cfg = cfg.Cfg()
+
+# Objects of the robot, the ROBOT_ID is appended to every name
+NAMES = [
+    "clawMotor", "leftMotor", "rightMotor",
+    "frontProximitySensor", "leftProximitySensor", "rightProximitySensor",
+    "visionLight", "visionCamera",
+]
+
+# Handles of the process: {"scene": scene path, "robot": ROBOT_ID, name: handle}
+_handles = {}
+_lock = RLock()
+
+def execute(client, code):
+    """ Evaluates the Lua expression *code* in CoppeliaSim with one request, returns its value """
+    with client.lock:
+        rep = client.simxExecuteScriptString(code, client.simxServiceCall())
+    if(not rep[0]): raise SystemError("CoppeliaSim isn't able to execute the script, check configurations")
+    return rep[1]
+
+def get_handle(client, name):
+    """
+    Returns the handle of the object *name* + ROBOT_ID
+
+    The first call resolves every name of NAMES in a single request, later calls
+    (from any object of the process) don't make any request. client.lock is taken
+    before _lock, as the callers that already hold it do.
+    """
+    with client.lock, _lock:
+        if _handles.get("robot") != cfg.ROBOT_ID or name not in _handles:
+            resolve(client, NAMES if name in NAMES else NAMES + [name])
+        handle = _handles[name]
+    if handle == -1: raise ValueError(name + str(cfg.ROBOT_ID) + " isn't in the scene")
+    return handle
+
+def resolve(client, names):
+    """ Resolves the handles of *names* (+ ROBOT_ID) in one request, missing objects get -1 """
+    code = "{" + ", ".join(["sim.getStringParam(sim.stringparam_scene_path_and_name)"] +
+                           ["sim.getObjectHandle('%s%s@silentError')" % (name, cfg.ROBOT_ID) for name in names]) + "}"
+    values = execute(client, code)
+    scene = values[0].decode() if isinstance(values[0], bytes) else values[0]
+    if _handles.get("scene") != scene or _handles.get("robot") != cfg.ROBOT_ID:
+        _handles.clear()
+    _handles.update(zip(names, values[1:]))
+    _handles["scene"] = scene
+    _handles["robot"] = cfg.ROBOT_ID
+
+def handles():
+    """ Returns the handles of the process, to be pickled with the objects that use them """
+    return dict(_handles)
+
+def seed(state):
+    """ Restores the handles returned by handles() in another process, so no lookups are made """
+    if state and not _handles:
+        _handles.update(state)
@@ -0,0 +1,50 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import os
+from threading import Lock, RLock
+
+import CoppeliaAPI.lib.b0RemoteApi as b0RemoteApi
+import CoppeliaAPI.csimProxy as csimProxy
+
+_lock = Lock()
+_sessions = {} # (pid, name) -> [client, references]
+
+def acquire(name="control"):
+    """
+    Returns the remote API client of the process for the *name* traffic, it is created by the first call
+
+    Every user of the process with the same *name* shares the client (one B0 node and one connection
+    to CoppeliaSim): BrickPi3 uses "control" and PiCamera "camera", so a slow image transfer doesn't
+    block encoder reads and motor commands. Calls on a client must hold its client.lock.
+    Every acquire must be paired with a release.
+    After csimProxy.start_proxy, the client goes through the proxy instead.
+    """
+    with _lock:
+        key = (os.getpid(), name) # a forked child can't use the client of its parent
+        session = _sessions.get(key)
+        if session is None:
+            if csimProxy.ADDRESS_VARIABLE in os.environ:
+                client = csimProxy.ProxyRemoteApiClient(name=name)
+            else:
+                # replies are only indexed, so they are unpacked as tuples
+                client = b0RemoteApi.RemoteApiClient('b0RemoteApiNode' + name.capitalize() + str(key[0]),'b0RemoteApiChannel', replyLists=False)
+            client.lock = RLock()
+            session = _sessions[key] = [client, 0]
+        session[1] += 1
+        return session[0]
+
+def release(client):
+    """ Releases a client returned by acquire, the connection is closed with the last reference """
+    with _lock:
+        for key, session in _sessions.items():
+            if session[0] is client and key[0] == os.getpid(): break
+        else: return
+        session[1] -= 1
+        if session[1] > 0: return
+        del _sessions[key]
+    # Disconnects from CoppeliaSim and frees the subscribers, publishers and B0 node.
+    # The dispatcher is stopped first without the lock, it may be waiting for it
+    client.simxStopDispatcher()
+    with client.lock:
+        client.__exit__(None, None, None)
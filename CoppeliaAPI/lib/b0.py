@@ -25,14 +25,25 @@ if libb0 is None:
     raise RuntimeError('%sb0%s not found' % (prefix, suffix))
 
 def _(n, ret, *args):
-    # perform encoding/decoding for char* argument (use str to enable conversion)
-    def _enc(v, t): return v.encode('ascii') if t == str else v
-    def _dec(v, t): return v.decode('ascii') if t == str else v
+    # binds the function once with its argtypes/restype (use str for char* arguments with conversion).
+    # Functions without str are the ctypes function itself, so calls have no Python wrapper at all
     def _wrap(t): return ct.c_char_p if t == str else t
-    # unwrapped CFUNCTYPE: (prefixed with _)
-    globals()['_' + n] = ct.CFUNCTYPE(_wrap(ret), *[_wrap(arg) for arg in args])((n, libb0))
-    # wrapped CFUNCTYPE: (performs string encoding/decoding)
-    globals()[n] = lambda *args2: _dec(globals()['_' + n](*[_enc(arg, t) for t, arg in zip(args, args2)]), ret)
+    # unwrapped function: (prefixed with _)
+    f = getattr(libb0, n)
+    f.restype = _wrap(ret)
+    f.argtypes = [_wrap(arg) for arg in args]
+    globals()['_' + n] = f
+    if ret != str and str not in args:
+        globals()[n] = f
+        return
+    # wrapped function: (performs string encoding/decoding, only the str positions are converted)
+    strArgs = [i for i, t in enumerate(args) if t == str]
+    def call(*args2):
+        args2 = list(args2)
+        for i in strArgs: args2[i] = args2[i].encode('ascii')
+        rep = f(*args2)
+        return rep.decode('ascii') if ret == str else rep
+    globals()[n] = call
 
 _("b0_init", ct.c_void_p, ct.POINTER(ct.c_int), ct.POINTER(ct.c_char_p))
 _("b0_is_initialized", ct.c_int)
@@ -91,6 +102,22 @@ _("b0_service_server_spin_once", None, ct.c_void_p)
 _("b0_service_server_get_service_name", str, ct.c_void_p)
 _("b0_service_server_log", None, ct.c_void_p, ct.c_int, str)
 
+class _Buffer:
+    # frees a buffer allocated by libb0 when the last view over it is gone
+    def __init__(self, ptr):
+        self._ptr = ptr
+
+    def __del__(self):
+        b0_buffer_delete(self._ptr)
+
+def _view(outbuf, size):
+    # read-only memoryview over a buffer returned by libb0, without copying it.
+    # The buffer is freed when the view and every view or array made from it are released
+    if not outbuf: return memoryview(b'')
+    arr = (ct.c_ubyte * size).from_address(outbuf)
+    arr._owner = _Buffer(outbuf)
+    return memoryview(arr).cast('B').toreadonly()
+
 def init():
     if b0_is_initialized()==0:
         argc = ct.c_int(1)
@@ -162,8 +189,8 @@ class Publisher:
         return b0_publisher_get_topic_name(self._pub)
 
     def publish(self, data):
-        buf = ct.c_char_p(data)
-        b0_publisher_publish(self._pub, buf, len(data))
+        # data is passed as it is (bytes), ctypes gives its buffer to the void* argument
+        b0_publisher_publish(self._pub, data, len(data))
 
     def log(self, level, message):
         b0_publisher_log(self._pub, level, message)
@@ -175,6 +202,8 @@ class Subscriber:
             return callback(data_bytes)
         self._cb = ct.CFUNCTYPE(None, ct.c_void_p, ct.c_size_t)(w)
         self._sub = b0_subscriber_new_ex(node._node, topic_name, self._cb, managed, notify_graph)
+        self._outsz = ct.c_size_t()
+        self._outszRef = ct.byref(self._outsz)
 
     def __del__(self):
         b0_subscriber_delete(self._sub)
@@ -201,12 +230,16 @@ class Subscriber:
         return b0_subscriber_poll(self._sub,timeout)
         
     def read(self):
-        outsz = ct.c_size_t()
-        outbuf = b0_subscriber_read(self._sub, ct.byref(outsz))
-        outarr = ct.cast(outbuf, ct.POINTER(ct.c_ubyte * outsz.value))
+        outbuf = b0_subscriber_read(self._sub, self._outszRef)
+        outarr = ct.cast(outbuf, ct.POINTER(ct.c_ubyte * self._outsz.value))
         rep_bytes = bytearray(outarr.contents)
         b0_buffer_delete(outbuf) # new on 16.01.2020
         return rep_bytes
+
+    def read_view(self):
+        # same as read, but returns a memoryview over the received buffer instead of a copy
+        outbuf = b0_subscriber_read(self._sub, self._outszRef)
+        return _view(outbuf, self._outsz.value)
         
     def set_option(self,option,optionVal):
         rep = b0_subscriber_set_option(self._sub,option,optionVal)
@@ -215,6 +248,8 @@ class Subscriber:
 class ServiceClient:
     def __init__(self, node, topic_name, managed=1, notify_graph=1):
         self._cli = b0_service_client_new_ex(node._node, topic_name, managed, notify_graph)
+        self._outsz = ct.c_size_t()
+        self._outszRef = ct.byref(self._outsz)
 
     def __del__(self):
         b0_service_client_delete(self._cli)
@@ -232,14 +267,16 @@ class ServiceClient:
         return b0_service_client_get_service_name(self._cli)
 
     def call(self, data):
-        buf = ct.c_char_p(data)
-        sz = len(data)
-        outsz = ct.c_size_t()
-        outbuf = b0_service_client_call(self._cli, buf, sz, ct.byref(outsz))
-        outarr = ct.cast(outbuf, ct.POINTER(ct.c_ubyte * outsz.value))
+        outbuf = b0_service_client_call(self._cli, data, len(data), self._outszRef)
+        outarr = ct.cast(outbuf, ct.POINTER(ct.c_ubyte * self._outsz.value))
         rep_bytes = bytearray(outarr.contents)
         b0_buffer_delete(outbuf) # new on 16.01.2020
         return rep_bytes
+
+    def call_view(self, data):
+        # same as call, but returns a memoryview over the reply buffer instead of a copy
+        outbuf = b0_service_client_call(self._cli, data, len(data), self._outszRef)
+        return _view(outbuf, self._outsz.value)
         
     def set_option(self,option,optionVal):
         rep = b0_service_client_set_option(self._cli,option,optionVal)
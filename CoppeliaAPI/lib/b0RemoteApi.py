@@ -10,10 +10,16 @@ import CoppeliaAPI.lib.b0 as b0 # modified import due to the inclusion in the Co
 import msgpack
 import random
 import string
+import threading
 import time
 
+# msgpack bin 8/16/32 and str 8/16/32 type bytes -> bytes of their length field
+_RAW_LENGTH_BYTES={0xc4:1,0xc5:2,0xc6:4,0xd9:1,0xda:2,0xdb:4}
+
 class RemoteApiClient:
-    def __init__(self,nodeName='b0RemoteApi_pythonClient',channelName='b0RemoteApi',inactivityToleranceInSec=60,setupSubscribersAsynchronously=False,timeout=3):
+    def __init__(self,nodeName='b0RemoteApi_pythonClient',channelName='b0RemoteApi',inactivityToleranceInSec=60,setupSubscribersAsynchronously=False,timeout=3,replyLists=True):
+        # replyLists=False: replies and subscriber messages are unpacked as tuples (msgpack use_list=False),
+        # which are cheaper to build, instead of lists
         self._channelName=channelName
         self._serviceCallTopic=channelName+'SerX'
         self._defaultPublisherTopic=channelName+'SubX'
@@ -24,6 +30,9 @@ class RemoteApiClient:
         b0.init()
         self._node=b0.Node(nodeName)
         self._clientId=''.join(random.choice(string.ascii_uppercase+string.ascii_lowercase+string.digits) for _ in range(10))
+        self._replyLists=replyLists
+        self._packer=msgpack.Packer()
+        self._headers={} # (funcName,topic,kind) -> packed [funcName,clientId,topic,kind] with the outer array header
         self._serviceClient=b0.ServiceClient(self._node,self._serviceCallTopic)
         self._serviceClient.set_option(3,timeout*1000) #read timeout
         self._defaultPublisher=b0.Publisher(self._node,self._defaultPublisherTopic)
@@ -38,11 +47,17 @@ class RemoteApiClient:
         self._allSubscribers={}
         self._allDedicatedPublishers={}
         self._setupSubscribersAsynchronously=setupSubscribersAsynchronously
+        self._socketsLock=threading.Lock() # subscriber sockets, polled by the dispatcher thread
+        self._waiting=0 # threads in simxWaitForMessage, they poll the sockets without the lock
+        self._removedSockets=[] # removed while waiting, cleaned up by the last waiter
+        self._imageTopics=set() # subscribers whose images are sliced from the message, see simxGetVisionSensorImageView
+        self._dispatcher=None
   
     def __enter__(self):
         return self
     
     def __exit__(self,*err):
+        self.simxStopDispatcher()
         print('*************************************************************************************')
         print('** Leaving... if this is unexpected, you might have to adjust the timeout argument **')
         print('*************************************************************************************')
@@ -62,39 +77,84 @@ class RemoteApiClient:
         self._pongReceived=True
         
     def _handleReceivedMessage(self,msg):
-        msg=msgpack.unpackb(msg,raw=True)
-        msg[0]=msg[0].decode('ascii')
-        if msg[0] in self._allSubscribers:
-            cbMsg=msg[1]
-            if len(cbMsg)==1:
-                cbMsg.append(None)
-            self._allSubscribers[msg[0]]['cb'](cbMsg)
+        if self._imageTopics:
+            # [topic,[ok,resolution,image]]: images of simxGetVisionSensorImageView subscribers stay in msg
+            unpacker=msgpack.Unpacker(raw=True)
+            unpacker.feed(msg[:128])
+            if unpacker.read_array_header()==2:
+                topic=unpacker.unpack().decode('ascii')
+                if topic in self._imageTopics:
+                    subscriber=self._allSubscribers.get(topic)
+                    rep=self._unpackImageView(msg,unpacker.tell())
+                    if subscriber is not None and rep is not None:
+                        subscriber['cb'](rep)
+                        return
+        msg=msgpack.unpackb(msg,raw=True,use_list=self._replyLists)
+        topic=msg[0].decode('ascii')
+        subscriber=self._allSubscribers.get(topic)
+        if subscriber is not None:
+            cbMsg=self._withValue(msg[1])
+            subscriber['cb'](cbMsg)
+
+    def _unpackImageView(self,view,offset):
+        # [ok,resolution,image] packed at view[offset:]: the header is unpacked from a copy of the first bytes
+        # and the image is sliced from the view. None if the image isn't bin/str 8, 16 or 32
+        unpacker=msgpack.Unpacker(raw=True,use_list=self._replyLists)
+        unpacker.feed(view[offset:offset+64])
+        size=unpacker.read_array_header()
+        rep=[unpacker.unpack() for _ in range(min(size,2))]
+        if size<3:
+            rep=rep+[None]*(3-len(rep))
+            return rep if self._replyLists else tuple(rep)
+        offset+=unpacker.tell()
+        lengthBytes=_RAW_LENGTH_BYTES.get(view[offset])
+        if lengthBytes is None:
+            return None
+        start=offset+1+lengthBytes
+        length=int.from_bytes(view[offset+1:start],'big')
+        rep.append(view[start:start+length])
+        return rep if self._replyLists else tuple(rep)
+
+    def _withValue(self,rep):
+        # replies with only the status get a None value
+        if len(rep)==1:
+            return rep+[None] if self._replyLists else rep+(None,)
+        return rep
+
+    def _pack(self,funcName,reqArgs,topic,kind):
+        # same bytes as msgpack.packb([[funcName,clientId,topic,kind],reqArgs]), the header is packed once
+        # per function and topic. Subscriber topics aren't cached, they are set up once
+        key=(funcName,topic,kind)
+        header=self._headers.get(key)
+        if header is None:
+            header=b'\x92'+msgpack.packb([funcName,self._clientId,topic,kind])
+            if kind in (0,1,3):
+                self._headers[key]=header
+        return header+self._packer.pack(reqArgs)
             
     def _handleFunction(self,funcName,reqArgs,topic):
         if topic==self._serviceCallTopic:
-            packedData=msgpack.packb([[funcName,self._clientId,topic,0],reqArgs])
-            rep = msgpack.unpackb(self._serviceClient.call(packedData),raw=True)
-            if len(rep)==1:
-                rep.append(None)
-            return rep
+            packedData=self._pack(funcName,reqArgs,topic,0)
+            rep = msgpack.unpackb(self._serviceClient.call_view(packedData),raw=True,use_list=self._replyLists)
+            return self._withValue(rep)
         elif topic==self._defaultPublisherTopic:
-            packedData=msgpack.packb([[funcName,self._clientId,topic,1],reqArgs])
+            packedData=self._pack(funcName,reqArgs,topic,1)
             self._defaultPublisher.publish(packedData)
         elif topic in self._allSubscribers:
             if self._allSubscribers[topic]['handle']==self._defaultSubscriber:
-                packedData=msgpack.packb([[funcName,self._clientId,topic,2],reqArgs])
+                packedData=self._pack(funcName,reqArgs,topic,2)
                 if self._setupSubscribersAsynchronously:
                     self._defaultPublisher.publish(packedData)
                 else:
                     self._serviceClient.call(packedData)
             else:
-                packedData=msgpack.packb([[funcName,self._clientId,topic,4],reqArgs])
+                packedData=self._pack(funcName,reqArgs,topic,4)
                 if self._setupSubscribersAsynchronously:
                     self._defaultPublisher.publish(packedData)
                 else:
                     self._serviceClient.call(packedData)
         elif topic in self._allDedicatedPublishers:
-            packedData=msgpack.packb([[funcName,self._clientId,topic,3],reqArgs])
+            packedData=self._pack(funcName,reqArgs,topic,3)
             self._allDedicatedPublishers[topic].publish(packedData)
         else:
             print('B0 Remote API error: invalid topic')
@@ -114,10 +174,11 @@ class RemoteApiClient:
     def simxDefaultSubscriber(self,cb,publishInterval=1):
         topic=self._channelName+'Pub'+str(self._nextDefaultSubscriberHandle)+self._clientId
         self._nextDefaultSubscriberHandle=self._nextDefaultSubscriberHandle+1
-        self._allSubscribers[topic]={}
-        self._allSubscribers[topic]['handle']=self._defaultSubscriber
-        self._allSubscribers[topic]['cb']=cb
-        self._allSubscribers[topic]['dropMessages']=False
+        value={}
+        value['handle']=self._defaultSubscriber
+        value['cb']=cb
+        value['dropMessages']=False
+        self._allSubscribers[topic]=value # complete when the dispatcher sees it
         channel=self._serviceCallTopic
         if self._setupSubscribersAsynchronously:
             channel=self._defaultPublisherTopic
@@ -132,11 +193,13 @@ class RemoteApiClient:
             sub.set_option(6,1) #conflate option enabled
         else:
             sub.set_option(6,0) #conflate option disabled
-        sub.init()
-        self._allSubscribers[topic]={}
-        self._allSubscribers[topic]['handle']=sub
-        self._allSubscribers[topic]['cb']=cb
-        self._allSubscribers[topic]['dropMessages']=dropMessages
+        with self._socketsLock:
+            sub.init()
+        value={}
+        value['handle']=sub
+        value['cb']=cb
+        value['dropMessages']=dropMessages
+        self._allSubscribers[topic]=value # complete when the dispatcher sees it
         channel=self._serviceCallTopic
         if self._setupSubscribersAsynchronously:
             channel=self._defaultPublisherTopic
@@ -152,9 +215,15 @@ class RemoteApiClient:
             if value['handle']==self._defaultSubscriber:
                 self._handleFunction('stopDefaultPublisher',[topic],channel)
             else:
-                value['handle'].cleanup()
+                with self._socketsLock:
+                    del self._allSubscribers[topic]
+                    if self._waiting>0:
+                        self._removedSockets.append(value['handle'])
+                    else:
+                        value['handle'].cleanup()
                 self._handleFunction('stopPublisher',[topic],channel)
-            del self._allSubscribers[topic]
+            self._allSubscribers.pop(topic,None)
+            self._imageTopics.discard(topic)
 
     def simxRemovePublisher(self,topic):
         if topic in self._allDedicatedPublishers:
@@ -165,23 +234,106 @@ class RemoteApiClient:
         
     def simxServiceCall(self):
         return self._serviceCallTopic
-        
+
     def simxSpin(self):
         while True:
             self.simxSpinOnce()
         
-    def simxSpinOnce(self):
-        defaultSubscriberAlreadyProcessed=False
-        for key, value in self._allSubscribers.items():
-            readData=None
-            if (value['handle']!=self._defaultSubscriber) or (not defaultSubscriberAlreadyProcessed):
-                defaultSubscriberAlreadyProcessed=defaultSubscriberAlreadyProcessed or (value['handle']==self._defaultSubscriber)
-                while value['handle'].poll(0):
-                    readData=value['handle'].read()
-                    if not value['dropMessages']:
-                        self._handleReceivedMessage(readData)
-                if value['dropMessages'] and (readData is not None):
-                    self._handleReceivedMessage(readData)
+    def simxSpinOnce(self,timeoutInMs=0):
+        # timeoutInMs: sleeps until a subscriber has a message (up to timeoutInMs, -1 without limit) instead of
+        # returning right away. While the dispatcher thread runs (simxStartDispatcher) it does nothing, the
+        # callbacks are called by the dispatcher
+        if self._dispatcher is not None:
+            return
+        if timeoutInMs!=0:
+            self.simxWaitForMessage(timeoutInMs)
+        self._spinOnce()
+
+    def _spinOnce(self):
+        with self._socketsLock:
+            received=[]
+            defaultSubscriberAlreadyProcessed=False
+            for key, value in list(self._allSubscribers.items()): # other threads may add subscribers
+                readData=None
+                if (value['handle']!=self._defaultSubscriber) or (not defaultSubscriberAlreadyProcessed):
+                    defaultSubscriberAlreadyProcessed=defaultSubscriberAlreadyProcessed or (value['handle']==self._defaultSubscriber)
+                    while value['handle'].poll(0):
+                        readData=value['handle'].read_view()
+                        if not value['dropMessages']:
+                            received.append(readData)
+                    if value['dropMessages'] and (readData is not None):
+                        received.append(readData)
+        # callbacks may add or remove subscribers
+        for readData in received:
+            self._handleReceivedMessage(readData)
+
+    def simxWaitForMessage(self,timeoutInMs=-1):
+        # Sleeps until a subscriber has a message or timeoutInMs elapses (-1 without limit), returns True if there is one.
+        # libb0 only waits on one socket: with default subscribers only, the wait is done in their socket,
+        # with dedicated subscribers too, the sockets are waited on in turns of 1 ms. The lock isn't held
+        # while waiting, so subscribers can be created and removed meanwhile (removed sockets are cleaned
+        # up once nobody waits on them), the ones created are waited on from the next call
+        with self._socketsLock:
+            sockets=[]
+            for value in list(self._allSubscribers.values()): # other threads may add subscribers
+                if value['handle'] not in sockets:
+                    sockets.append(value['handle'])
+            self._waiting+=1
+        try:
+            if len(sockets)==0:
+                if timeoutInMs>0:
+                    time.sleep(timeoutInMs/1000)
+                return False
+            if len(sockets)==1:
+                return bool(sockets[0].poll(timeoutInMs))
+            for sub in sockets:
+                if sub.poll(0):
+                    return True
+            end=time.time()+timeoutInMs/1000
+            while timeoutInMs<0 or time.time()<end:
+                for sub in sockets:
+                    if sub.poll(1):
+                        return True
+            return False
+        finally:
+            with self._socketsLock:
+                self._waiting-=1
+                if self._waiting==0:
+                    for sub in self._removedSockets:
+                        sub.cleanup()
+                    self._removedSockets=[]
+
+    def simxStartDispatcher(self,lock=None,timeoutInMs=10):
+        # Starts a thread that sleeps until subscriber messages arrive and calls their callbacks right away,
+        # so nobody has to spin the client. Callbacks are called holding lock (e.g. the lock that serializes
+        # the calls of the client), it isn't held while waiting. simxSpinOnce does nothing until simxStopDispatcher
+        if self._dispatcher is not None:
+            return
+        self._dispatcher=threading.Thread(target=self._dispatchLoop,args=(lock,timeoutInMs),daemon=True)
+        self._dispatcher.start()
+
+    def simxStopDispatcher(self):
+        dispatcher=self._dispatcher
+        if dispatcher is None:
+            return
+        self._dispatcher=None
+        if dispatcher is not threading.current_thread():
+            dispatcher.join()
+
+    def _dispatchLoop(self,lock,timeoutInMs):
+        try:
+            while self._dispatcher is threading.current_thread():
+                if not self.simxWaitForMessage(timeoutInMs):
+                    continue
+                if lock is None:
+                    self._spinOnce()
+                else:
+                    with lock:
+                        self._spinOnce()
+        finally:
+            # if the thread dies, simxSpinOnce works again
+            if self._dispatcher is threading.current_thread():
+                self._dispatcher=None
                     
     def simxGetTimeInMs(self):
         return self._node.hardware_time_usec()/1000;    
@@ -583,6 +735,22 @@ class RemoteApiClient:
         reqArgs = [filename]
         return self._handleFunction('LoadScene',reqArgs,topic)
 
+    def simxGetVisionSensorImageView(self,objectHandle,greyScale,topic):
+        # Same as simxGetVisionSensorImage, but the image is a read-only memoryview over the received
+        # message instead of a copy, with simxServiceCall and with subscribers (the callback gets the view).
+        # The message is freed when the view (and any array made from it) is released
+        if topic in self._allSubscribers:
+            self._imageTopics.add(topic)
+            return self.simxGetVisionSensorImage(objectHandle,greyScale,topic)
+        if topic!=self._serviceCallTopic:
+            return self.simxGetVisionSensorImage(objectHandle,greyScale,topic)
+        packedData=self._pack('GetVisionSensorImage',[objectHandle,greyScale],topic,0)
+        view=self._serviceClient.call_view(packedData)
+        rep=self._unpackImageView(view,0)
+        if rep is None:
+            return msgpack.unpackb(view,raw=True,use_list=self._replyLists)
+        return rep
+
     # -----------------------------------------------------------
     # Add your custom functions here, or even better,
     # add them to b0RemoteApiBindings/generate/simxFunctions.xml,
@@ -0,0 +1,113 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from CoppeliaAPI.lib.b0RemoteApi import RemoteApiClient
+
+class AsyncRemoteApiClient:
+    """
+    asyncio version of RemoteApiClient, every simx* function is a coroutine.
+
+    A B0 socket can't be used from two threads at once, so the calls are executed by a single thread
+    per client while the event loop keeps running other coroutines (reads of a client of another
+    session, image decoding...), and the subscriber sockets are waited on and read by another one.
+    libb0 doesn't expose its sockets, so the event loop can't watch them itself. If the client has a
+    lock (csimSession clients), it is held during each call, so threads using the client directly
+    can coexist with the coroutines.
+
+    Subscriber callbacks are called in the event loop, from simxSpinOnce or the simxSpin task:
+
+        client = AsyncRemoteApiClient(csimSession.acquire("control"))
+        topic = await client.simxDefaultSubscriber(callback)
+        await client.simxGetSimulationTime(topic)
+        asyncio.ensure_future(client.simxSpin())
+    """
+
+    def __init__(self, client=None, **kwargs):
+        """
+        client -- client to wrap, a new RemoteApiClient(**kwargs) is created (and closed by close) if None
+        """
+        self._owner = client is None
+        self.client = RemoteApiClient(**kwargs) if client is None else client
+        self._lock = getattr(self.client, "lock", None)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._waiter = ThreadPoolExecutor(max_workers=1) # waits and reads of the subscriber sockets
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *err):
+        await self.close()
+
+    async def close(self):
+        """ Stops the thread of the client, the client is closed if it was created by this object """
+        if self._owner: await self.run(self.client.__exit__, None, None, None)
+        self._executor.shutdown(wait=False)
+        self._waiter.shutdown(wait=False)
+
+    async def run(self, function, *args, **kwargs):
+        """ Executes function(*args, **kwargs) in the thread of the client and returns its result """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self._call, function, *args, **kwargs))
+
+    def _call(self, function, *args, **kwargs):
+        if self._lock is None: return function(*args, **kwargs)
+        with self._lock:
+            return function(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not name.startswith("simx") or not callable(attr): return attr
+        async def call(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    # Topics don't make requests, they are returned right away
+    def simxServiceCall(self):
+        return self.client.simxServiceCall()
+
+    def simxDefaultPublisher(self):
+        return self.client.simxDefaultPublisher()
+
+    def simxGetTimeInMs(self):
+        return self.client.simxGetTimeInMs()
+
+    async def simxDefaultSubscriber(self, cb, publishInterval=1):
+        return await self.run(self.client.simxDefaultSubscriber, self._inLoop(cb), publishInterval)
+
+    async def simxCreateSubscriber(self, cb, publishInterval=1, dropMessages=False):
+        return await self.run(self.client.simxCreateSubscriber, self._inLoop(cb), publishInterval, dropMessages)
+
+    async def simxSpinOnce(self, timeoutInMs=0):
+        """
+        Calls the callbacks of the received subscriber messages, waiting in the subscriber sockets
+        up to *timeoutInMs* (-1 without limit) until one arrives. The wait is done by the thread of the
+        subscriber sockets, without the lock, so the calls of other coroutines aren't delayed.
+        The callbacks have run in the event loop when it returns.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._waiter, self._spinOnce, timeoutInMs)
+
+    def _spinOnce(self, timeoutInMs):
+        if timeoutInMs != 0 and self.client._dispatcher is None:
+            self.client.simxWaitForMessage(timeoutInMs)
+        self._call(self.client.simxSpinOnce)
+
+    async def simxSpin(self, timeoutInMs=100):
+        """ Dispatches the subscriber messages as they arrive, until cancelled """
+        while True:
+            await self.simxSpinOnce(timeoutInMs)
+
+    async def simxSleep(self, durationInMs):
+        await asyncio.sleep(durationInMs / 1000)
+
+    def _inLoop(self, cb):
+        """ Wraps a subscriber callback so it's called in the running event loop """
+        loop = asyncio.get_running_loop()
+        def callback(msg):
+            loop.call_soon_threadsafe(cb, msg)
+        return callback
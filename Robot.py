@@ -99,6 +99,8 @@ class Robot:
 
     def startOdometry(self):
         """ This starts a new process/thread that will be updating the odometry periodically """
+        # In the simulator, CoppeliaAPI.csimProxy.start_proxy() (called before creating the BrickPi3)
+        # makes every process share a single connection to CoppeliaSim
         self.finished.value = False
         self.p = Process(target=self.updateOdometry, args=()) #additional_params?))
         self.p.start()
@@ -155,6 +157,8 @@ class Robot:
 
             tEnd = time.clock()
             time.sleep(self.P - (tEnd-tIni))
+            # In the simulator the period can be kept in simulation time instead:
+            #   tIni = self.BP.clock.now() ... self.BP.clock.sleep_until(tIni + self.P)
 
         #print("Stopping odometry ... X= %d" %(self.x.value))
         sys.stdout.write("Stopping odometry ... X=  %.2f, \
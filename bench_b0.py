@@ -0,0 +1,71 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+#
+# Make sure to have CoppeliaSim running, with followig scene loaded: tests.ttt
+#
+# Microbenchmark of the per-call overhead of the libb0 bindings (CoppeliaAPI/lib/b0.py).
+# Compares the generic wrapper used before (a lambda doing the type dispatch on every call)
+# with the precomputed bindings, for publish, poll and call on a connected client.
+
+import ctypes as ct
+import time
+
+import msgpack
+
+import CoppeliaAPI.lib.b0 as b0
+import CoppeliaAPI.csimSession as csimSession
+
+REPEAT = 20000
+
+def legacy(n, ret, *args):
+    """ Binding of the function *n* as done by b0.py before the precomputed bindings """
+    def _enc(v, t): return v.encode('ascii') if t == str else v
+    def _dec(v, t): return v.decode('ascii') if t == str else v
+    def _wrap(t): return ct.c_char_p if t == str else t
+    functions = {}
+    functions['_' + n] = ct.CFUNCTYPE(_wrap(ret), *[_wrap(arg) for arg in args])((n, b0.libb0))
+    return lambda *args2: _dec(functions['_' + n](*[_enc(arg, t) for t, arg in zip(args, args2)]), ret)
+
+legacy_publish = legacy("b0_publisher_publish", None, ct.c_void_p, ct.c_void_p, ct.c_size_t)
+legacy_poll = legacy("b0_subscriber_poll", ct.c_int, ct.c_void_p, ct.c_long)
+legacy_call = legacy("b0_service_client_call", ct.c_void_p, ct.c_void_p, ct.c_void_p, ct.c_size_t, ct.POINTER(ct.c_size_t))
+
+def timeit(function, repeat, *args):
+    """ Returns the mean time of a call in microseconds """
+    tIni = time.perf_counter()
+    for _ in range(repeat): function(*args)
+    return (time.perf_counter() - tIni) / repeat * 1e6
+
+def old_publish(pub, data):
+    legacy_publish(pub._pub, ct.c_char_p(data), len(data))
+
+def old_poll(sub):
+    return legacy_poll(sub._sub, 0)
+
+def old_call(cli, data):
+    outsz = ct.c_size_t()
+    outbuf = legacy_call(cli._cli, ct.c_char_p(data), len(data), ct.byref(outsz))
+    rep_bytes = bytearray(ct.cast(outbuf, ct.POINTER(ct.c_ubyte * outsz.value)).contents)
+    b0.b0_buffer_delete(outbuf)
+    return rep_bytes
+
+if __name__ == "__main__":
+    client = csimSession.acquire()
+    try:
+        pub = client._defaultPublisher
+        sub = client._defaultSubscriber
+        cli = client._serviceClient
+        # a request without effects, as sent by client.simxGetSimulationTime(client.simxServiceCall())
+        data = msgpack.packb([["GetSimulationTime", client._clientId, client.simxServiceCall(), 0], [0]])
+        # executed by CoppeliaSim without reply, as client.simxGetSimulationTime(client.simxDefaultPublisher())
+        message = msgpack.packb([["GetSimulationTime", client._clientId, client.simxDefaultPublisher(), 1], [0]])
+
+        print("{:>8} {:>10} {:>10}".format("", "old (us)", "new (us)"))
+        print("{:>8} {:>10.2f} {:>10.2f}".format("publish", timeit(old_publish, REPEAT, pub, message),
+                                                 timeit(pub.publish, REPEAT, message)))
+        print("{:>8} {:>10.2f} {:>10.2f}".format("poll", timeit(old_poll, REPEAT, sub),
+                                                 timeit(sub.poll, REPEAT, 0)))
+        print("{:>8} {:>10.2f} {:>10.2f}".format("call", timeit(old_call, REPEAT // 20, cli, data),
+                                                 timeit(cli.call_view, REPEAT // 20, data)))
+    finally:
+        csimSession.release(client)
@@ -0,0 +1,66 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+#
+# Make sure to have CoppeliaSim running, with followig scene loaded: tests.ttt
+#
+# Benchmark of the control latency while the camera is capturing.
+# A thread reads the encoders of PORT_B and PORT_C in a loop, first alone and then while another
+# thread captures frames as fast as it can. The camera and the BrickPi3 use separate sessions,
+# so the encoder reads shouldn't wait for the image transfers.
+
+import threading
+import time
+
+import numpy as np
+
+import CoppeliaAPI.csimBrickpi as brickpi3
+from CoppeliaAPI.csimCamera import PiCamera, PiRGBArray
+
+SAMPLES = 500
+
+def encoder_latencies(BP, samples):
+    """ Returns the latency of each encoder read in milliseconds """
+    latencies = []
+    for _ in range(samples):
+        tIni = time.perf_counter()
+        BP.get_motor_encoder(BP.PORT_B)
+        BP.get_motor_encoder(BP.PORT_C)
+        latencies.append((time.perf_counter() - tIni) * 1000)
+    return latencies
+
+def capture_loop(cam, running, frames):
+    """ Captures frames until running is cleared """
+    rawCapture = PiRGBArray(cam, size=cam.resolution)
+    while running.is_set():
+        cam.capture(rawCapture, format="bgr")
+        frames.append(time.perf_counter())
+
+def report(name, latencies):
+    print("{:>16} {:>10.3f} {:>10.3f} {:>10.3f}".format(name, np.percentile(latencies, 50),
+          np.percentile(latencies, 95), max(latencies)))
+
+if __name__ == "__main__":
+    BP = brickpi3.BrickPi3(streaming=False)
+    cam = PiCamera()
+    cam.step_cache = False # every capture transfers a frame
+
+    try:
+        print("{:>16} {:>10} {:>10} {:>10}".format("", "p50 (ms)", "p95 (ms)", "max (ms)"))
+        report("idle", encoder_latencies(BP, SAMPLES))
+
+        running = threading.Event()
+        running.set()
+        frames = []
+        capturing = threading.Thread(target=capture_loop, args=(cam, running, frames), daemon=True)
+        capturing.start()
+        time.sleep(0.5)
+        tIni = time.perf_counter()
+        latencies = encoder_latencies(BP, SAMPLES)
+        fps = sum(1 for t in frames if t >= tIni) / (time.perf_counter() - tIni)
+        running.clear()
+        capturing.join()
+        report("while capturing", latencies)
+        print("camera: {:.1f} fps".format(fps))
+    finally:
+        cam.close()
+        BP.reset_all()
@@ -0,0 +1,63 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+#
+# Benchmark of the PiCamera frame decoding, CoppeliaSim is not needed.
+# Compares the old per-pixel loop with the vectorized decode_image and checks both give the same image,
+# then compares the color path with the greyscale one ("gray" format)
+
+import time
+
+import cv2
+import numpy as np
+
+from CoppeliaAPI.csimDecode import decode_image
+
+RESOLUTIONS = [(128, 128), (320, 240), (512, 512), (640, 480)]
+
+def loop_decode(imageBytes, resolution, format, reverse):
+    """ Decoding used by PiCamera.capture before decode_image """
+    img = np.zeros([resolution[1], resolution[0], 3], dtype = "uint8")
+    for i in range(resolution[1]):
+        for j in range(resolution[0]):
+            pixel = list(imageBytes[3*(j+i*resolution[0]) : 3*(j+i*resolution[0]) + 3])
+            img[resolution[1] - 1 - i][j] = pixel
+    if format == "bgr": img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if reverse: img = cv2.flip(cv2.flip(img, 0), 1)
+    return img
+
+def vector_decode(imageBytes, resolution, format, reverse):
+    """ Decoding used by PiCamera.capture """
+    return np.ascontiguousarray(decode_image(imageBytes, resolution, format, reverse))
+
+def grey_decode(imageBytes, resolution, format, reverse):
+    """ Decoding used by PiCamera.capture for the "gray" and "y" formats """
+    return np.ascontiguousarray(decode_image(imageBytes, resolution, "gray", reverse))
+
+def timeit(function, repeat, *args):
+    """ Returns the mean time of a call in milliseconds """
+    tIni = time.perf_counter()
+    for _ in range(repeat): function(*args)
+    return (time.perf_counter() - tIni) / repeat * 1000
+
+if __name__ == "__main__":
+    print("{:>10} {:>12} {:>12} {:>10}".format("resolution", "loop (ms)", "vector (ms)", "speedup"))
+    for resolution in RESOLUTIONS:
+        imageBytes = np.random.randint(0, 256, resolution[0] * resolution[1] * 3, dtype=np.uint8).tobytes()
+        for format in ("rgb", "bgr"):
+            for reverse in (False, True):
+                assert np.array_equal(loop_decode(imageBytes, resolution, format, reverse),
+                                      vector_decode(imageBytes, resolution, format, reverse))
+
+        loop = timeit(loop_decode, 1, imageBytes, resolution, "bgr", False)
+        vector = timeit(vector_decode, 200, imageBytes, resolution, "bgr", False)
+        print("{:>10} {:>12.3f} {:>12.3f} {:>9.0f}x".format("%dx%d" % resolution, loop, vector, loop / vector))
+
+    print()
+    print("{:>10} {:>12} {:>12} {:>12} {:>12}".format("resolution", "bgr (KB)", "gray (KB)", "bgr (ms)", "gray (ms)"))
+    for resolution in RESOLUTIONS:
+        colorBytes = np.random.randint(0, 256, resolution[0] * resolution[1] * 3, dtype=np.uint8).tobytes()
+        greyBytes = np.random.randint(0, 256, resolution[0] * resolution[1], dtype=np.uint8).tobytes()
+        color = timeit(vector_decode, 200, colorBytes, resolution, "bgr", False)
+        grey = timeit(grey_decode, 200, greyBytes, resolution, "gray", False)
+        print("{:>10} {:>12.1f} {:>12.1f} {:>12.3f} {:>12.3f}".format("%dx%d" % resolution,
+              len(colorBytes) / 1024, len(greyBytes) / 1024, color, grey))
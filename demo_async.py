@@ -0,0 +1,40 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+#
+# Make sure to have CoppeliaSim running, with followig scene loaded: tests.ttt
+
+import asyncio
+
+import cv2
+
+from CoppeliaAPI.csimAsync import AsyncBrickPi3, AsyncPiCamera
+from CoppeliaAPI.csimCamera import PiRGBArray
+
+async def control(BP):
+    # encoder reads and motor commands aren't delayed by the image transfers
+    while True:
+        encoder_val1, encoder_val2 = await asyncio.gather(BP.get_motor_encoder(BP.PORT_B),
+                                                          BP.get_motor_encoder(BP.PORT_C))
+        print("Encoder values: {}, {}".format(encoder_val1, encoder_val2))
+        await BP.set_motor_dps(BP.PORT_B + BP.PORT_C, 200)
+        await BP.sleep(0.05)
+
+async def vision(cam):
+    rawCapture = PiRGBArray(cam.camera, size=cam.resolution)
+    async for frame in cam.capture_continuous(rawCapture, format="bgr"):
+        cv2.imshow("image", frame.array)
+        cv2.waitKey(1)
+
+async def main():
+    BP = AsyncBrickPi3()
+    cam = AsyncPiCamera()
+    try:
+        await asyncio.gather(control(BP), vision(cam))
+    finally:
+        await cam.close()
+        await BP.reset_all()
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt: # except the program gets interrupted by Ctrl+C on the keyboard.
+    pass
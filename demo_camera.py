@@ -11,7 +11,7 @@ from CoppeliaAPI.csimCamera import PiRGBArray
 # camera conf
 cam = picamera.PiCamera()
 cam.resolution = (512, 512)
-#cam.framerate = 32
+cam.framerate = 32
 
 # reference return format
 rawCapture = PiRGBArray(cam, size=(512, 512))
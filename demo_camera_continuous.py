@@ -0,0 +1,25 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+#
+# Make sure to have CoppeliaSim running, with followig scene loaded: tests.ttt
+
+import cv2
+
+import CoppeliaAPI.csimCamera as picamera
+from CoppeliaAPI.csimCamera import PiRGBArray
+
+# camera conf
+cam = picamera.PiCamera()
+cam.resolution = (512, 512)
+
+# reference return format
+rawCapture = PiRGBArray(cam, size=(512, 512))
+try:
+    # frames are streamed, only the newest one is processed
+    for frame in cam.capture_continuous(rawCapture, format="bgr"):
+        img = frame.array
+        cv2.imshow("image", img)
+        cv2.waitKey(1)
+        rawCapture.truncate(0)
+except KeyboardInterrupt: # except the program gets interrupted by Ctrl+C on the keyboard.
+    cam.close()        # Unconfigure the sensors, disable the motors.
@@ -0,0 +1,20 @@
+# Author: Alberto Martínez Rodríguez
+# Date: January 2022
+# 
+# Make sure to have CoppeliaSim running, with followig scene loaded: tests.ttt
+
+import CoppeliaAPI.csimBrickpi as brickpi3
+
+# The simulation only advances when BP.step is called
+BP = brickpi3.BrickPi3(synchronous=True)
+
+try:
+    while True:
+        encoder_val1 = BP.get_motor_encoder(BP.PORT_B)
+        encoder_val2 = BP.get_motor_encoder(BP.PORT_C)
+        print("Encoder values: {}, {}".format(encoder_val1, encoder_val2))
+
+        BP.set_motor_dps(BP.PORT_B + BP.PORT_C, 200)
+        BP.step(10) # 10 simulation steps, as fast as the CPU allows
+except KeyboardInterrupt: # except the program gets interrupted by Ctrl+C on the keyboard.
+    BP.reset_all()        # Unconfigure the sensors, disable the motors.
@@ -25,7 +25,7 @@ with b0RemoteApi.RemoteApiClient('b0RemoteApi_pythonClient','b0RemoteApi',60) as
 
     def waitForMovementExecuted(id):
         while client.executedMovId!=id:
-            client.simxSpinOnce()
+            client.simxSpinOnce(100) # sleeps until a message arrives instead of spinning
 
     def executedMovId_callback(msg):
         if type(msg[1])==bytes: